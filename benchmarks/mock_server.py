@@ -0,0 +1,201 @@
+"""
+Local stand-in for an OpenAI-compatible `/v1/chat/completions` endpoint, used by the benchmarks.
+
+Responses are generated without a model: the latency follows a configurable distribution plus a
+per-token generation time, structured-output requests get a JSON object matching the requested
+schema, and a fraction of the requests can be failed with 500 or 429 responses.
+
+Usage:
+    python benchmarks/mock_server.py --port 8089 --latency lognormal --latency-mean 0.2 --token-rate 100
+"""
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import asyncio
+import subprocess
+import sys
+import os
+from aiohttp import web # type: ignore
+
+
+def sample_latency(options):
+    """Draw the time to first token (in seconds) from the configured distribution."""
+    mean = options.latency_mean
+    if options.latency == "fixed":
+        return mean
+    if options.latency == "uniform":
+        return random.uniform(0, 2 * mean)
+    if options.latency == "exponential":
+        return random.expovariate(1 / mean) if mean > 0 else 0.0
+    if options.latency == "lognormal":
+        # Parametrised so that the mean of the distribution is `latency_mean`
+        sigma = options.latency_sigma
+        return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma) if mean > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {options.latency}")
+
+
+def example_value(schema, definitions):
+    """Build a value that validates against a JSON schema (the subset produced by Pydantic)."""
+    if "$ref" in schema:
+        return example_value(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    for key in ["anyOf", "oneOf", "allOf"]:
+        if key in schema:
+            return example_value(schema[key][0], definitions)
+
+    schema_type = schema.get("type", "string")
+    if schema_type == "object":
+        return {name: example_value(field, definitions) for name, field in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [example_value(schema["items"], definitions)] if "items" in schema else []
+    if schema_type == "integer":
+        return 1
+    if schema_type == "number":
+        return 1.0
+    if schema_type == "boolean":
+        return True
+    if schema_type == "null":
+        return None
+    return "example"
+
+
+def build_content(request, options):
+    response_format = request.get("response_format") or {}
+    json_schema = response_format.get("json_schema") or {}
+    schema = json_schema.get("schema") or response_format.get("schema")
+    if schema:
+        return json.dumps(example_value(schema, schema.get("$defs", {})))
+    if response_format.get("type") == "json_object":
+        return "{}"
+    words = ["Present"] + ["lorem"] * max(options.completion_tokens - 1, 0)
+    return " ".join(words)
+
+
+def count_prompt_tokens(messages):
+    # Rough count (4 characters per token) that is good enough for throughput accounting
+    characters = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        characters += len(content)
+    return max(characters // 4, 1)
+
+
+def create_app(options):
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    async def chat_completions(http_request):
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            request = await http_request.json()
+            roll = random.random()
+            if roll < options.rate_limit_rate:
+                stats["rate_limited"] += 1
+                return web.json_response(
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                    status=429,
+                    headers={"retry-after": str(options.retry_after)},
+                )
+            if roll < options.rate_limit_rate + options.error_rate:
+                stats["errors"] += 1
+                await asyncio.sleep(sample_latency(options))
+                return web.json_response({"error": {"message": "Injected server error", "type": "server_error"}}, status=500)
+
+            content = build_content(request, options)
+            completion_tokens = max(len(content) // 4, 1)
+            delay = sample_latency(options)
+            if options.token_rate > 0:
+                delay += completion_tokens / options.token_rate
+            await asyncio.sleep(delay)
+
+            prompt_tokens = count_prompt_tokens(request.get("messages", []))
+            return web.json_response({
+                "id": f"chatcmpl-{stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            })
+        finally:
+            stats["in_flight"] -= 1
+
+    async def get_stats(http_request):
+        return web.json_response(stats)
+
+    async def get_models(http_request):
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    app = web.Application(client_max_size=64 * 2**20)
+    for prefix in ["", "/v1"]:
+        app.router.add_post(f"{prefix}/chat/completions", chat_completions)
+        app.router.add_get(f"{prefix}/models", get_models)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal", help="Distribution of the time to first token")
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="Mean time to first token in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Shape of the lognormal distribution")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Generated tokens per second per request (0 for instant generation)")
+    parser.add_argument("--completion-tokens", type=int, default=1, help="Length of plain-text answers in tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failed with a 500 response")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failed with a 429 response")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After header of 429 responses, in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def start_server(port=None, **options):
+    """
+    Start the mock server in a subprocess and wait until it accepts connections.
+
+    Args:
+        port (int): Port to listen on. A free port is picked if None.
+        **options: Command line options of the server, e.g. latency_mean=0.1
+
+    Returns:
+        tuple: (subprocess.Popen, base URL)
+    """
+    if port is None:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+    command = [sys.executable, os.path.abspath(__file__), "--port", str(port)]
+    for key, value in options.items():
+        if value is not None:
+            command += [f"--{key.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Mock server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock server did not start within 30 seconds")
+
+
+if __name__ == "__main__":
+    options = get_parser().parse_args()
+    if options.seed is not None:
+        random.seed(options.seed)
+    web.run_app(create_app(options), host=options.host, port=options.port, print=None, access_log=None)
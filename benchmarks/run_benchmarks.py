@@ -0,0 +1,294 @@
+"""
+End-to-end throughput benchmarks of the RadPrompter engine against the local mock server.
+
+Every combination of the swept parameters runs in its own subprocess (so that peak memory and CPU
+time are measured in isolation) against a single mock server. Results are printed as a table and
+written as JSON, which `--compare` checks against a previous run to spot regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --concurrency 1 16 128 --items 500 --schemas 1 4
+    python benchmarks/run_benchmarks.py --compare results/old.json results/new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import start_server
+
+# Parameters swept by the benchmark, with their default values
+SWEEP = {
+    "concurrency": [1, 16, 128],
+    "items": [200],
+    "report_words": [300],
+    "schemas": [1, 4],
+    "hide_blocks": [False, True],
+    "use_pydantic": [False, True],
+}
+
+# Metrics compared by `--compare`, with True if higher is better
+METRICS = {
+    "items_per_second": True,
+    "requests_per_second": True,
+    "request_p50": False,
+    "request_p99": False,
+    "item_p50": False,
+    "item_p99": False,
+    "peak_rss_mb": False,
+    "cpu_ms_per_request": False,
+}
+
+WORDS = "the a of lung nodule right left upper lower lobe opacity effusion pleural no evidence mass cm contrast".split()
+
+
+def write_prompt(path, schemas):
+    lines = [
+        "[METADATA]",
+        "version = 0.1",
+        'description = "Benchmark prompt"',
+        "",
+        "[PROMPTS]",
+        'system_prompt = "You extract data elements from radiology reports."',
+        'user_prompt = """Here is the report:\n<report>\n{{report}}\n</report>\n\nExtract {{variable_name}}:\n{{hint}}\n"""',
+        "",
+        "[CONSTRUCTOR]",
+        'system = "rdp(system_prompt)"',
+        'user = ["rdp(user_prompt)"]',
+        "",
+        "[SCHEMAS]",
+    ]
+    for i in range(schemas):
+        lines += [
+            f"[SCHEMAS.Finding{i}]",
+            f'variable_name = "Finding {i}"',
+            'type = "select"',
+            'options = ["Present", "Absent"]',
+            "show_options_in_hint = false",
+            f'hint = "Indicate `Present` if finding {i} is reported, `Absent` otherwise."',
+            "",
+        ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def make_reports(items, words, seed=0):
+    rng = random.Random(seed)
+    for index in range(items):
+        yield {"report": f"Report {index}. " + " ".join(rng.choice(WORDS) for _ in range(words))}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else None
+
+
+def run_worker(config):
+    """Run one benchmark configuration in the current process and return its measurements."""
+    from radprompter import Prompt, RadPrompter, UniversalClient, vLLMClient, RetryPolicy
+
+    class TimedRadPrompter(RadPrompter):
+        # Records the end-to-end latency of every item
+        async def aprocess_single_item(self, item, index):
+            start = time.perf_counter()
+            try:
+                return await super().aprocess_single_item(item, index)
+            finally:
+                self.item_latencies.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as directory:
+        prompt_file = os.path.join(directory, "benchmark.toml")
+        write_prompt(prompt_file, config["schemas"])
+        prompt = Prompt(prompt_file)
+
+        client_options = {"api_base": config["api_base"], "api_key": "mock", "temperature": 0.0}
+        if config["max_attempts"] > 1:
+            client_options["retry_policy"] = RetryPolicy(max_attempts=config["max_attempts"], base_delay=0.05)
+        if config["client"] == "vllm":
+            client = vLLMClient("mock", **client_options)
+        else:
+            client = UniversalClient("openai/mock", **client_options)
+
+        engine = TimedRadPrompter(
+            client=client,
+            prompt=prompt,
+            output_file=os.path.join(directory, "output.csv"),
+            hide_blocks=config["hide_blocks"],
+            concurrency=config["concurrency"],
+            use_pydantic=config["use_pydantic"],
+        )
+        engine.item_latencies = []
+
+        usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        engine(make_reports(config["items"], config["report_words"]))
+        duration = time.perf_counter() - start
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    totals = engine.telemetry.totals()
+    cpu_seconds = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    return {
+        "duration": duration,
+        "requests": totals["requests"],
+        "failed_requests": totals["errors"],
+        "items_per_second": config["items"] / duration,
+        "requests_per_second": totals["requests"] / duration,
+        "request_p50": totals["p50"],
+        "request_p99": totals["p99"],
+        "item_p50": percentile(engine.item_latencies, 0.5),
+        "item_p99": percentile(engine.item_latencies, 0.99),
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": usage_end.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10),
+        "cpu_ms_per_request": 1000 * cpu_seconds / max(totals["requests"], 1),
+    }
+
+
+def run_configuration(config):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark {config} failed:\n{result.stderr[-4000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_table(results):
+    columns = ["concurrency", "items", "report_words", "schemas", "hide_blocks", "use_pydantic",
+               "items_per_second", "requests_per_second", "request_p50", "request_p99", "item_p99",
+               "peak_rss_mb", "cpu_ms_per_request", "failed_requests"]
+    rows = [[_format(result.get(column)) for column in columns] for result in results]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def compare(baseline_file, candidate_file, tolerance):
+    """Print the metrics that got worse by more than `tolerance` and return the number of regressions."""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(candidate_file) as f:
+        candidate = json.load(f)
+
+    def key(result):
+        return tuple(result[name] for name in SWEEP)
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"Baseline: RadPrompter {baseline['version']} ({baseline['date']}), candidate: RadPrompter {candidate['version']} ({candidate['date']})")
+    for result in candidate["results"]:
+        reference = baseline_results.get(key(result))
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions += 1
+                print(f"REGRESSION {dict(zip(SWEEP, key(result)))} {metric}: {_format(old)} -> {_format(new)} ({change:+.1%})")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="RadPrompter throughput benchmarks")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=SWEEP["concurrency"])
+    parser.add_argument("--items", type=int, nargs="+", default=SWEEP["items"])
+    parser.add_argument("--report-words", type=int, nargs="+", default=SWEEP["report_words"])
+    parser.add_argument("--schemas", type=int, nargs="+", default=SWEEP["schemas"])
+    parser.add_argument("--hide-blocks", type=_boolean, nargs="+", default=SWEEP["hide_blocks"])
+    parser.add_argument("--use-pydantic", type=_boolean, nargs="+", default=SWEEP["use_pydantic"])
+    parser.add_argument("--client", choices=["universal", "vllm"], default="vllm")
+    parser.add_argument("--max-attempts", type=int, default=1, help="Attempts per request (a RetryPolicy is used if > 1)")
+    parser.add_argument("--latency", default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.05)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/results/<version>-<date>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change reported as a regression by --compare")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser
+
+
+def _boolean(value):
+    if value.lower() in ["1", "true", "yes"]:
+        return True
+    if value.lower() in ["0", "false", "no"]:
+        return False
+    raise argparse.ArgumentTypeError(f"Expected a boolean, got {value!r}")
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.tolerance) else 0)
+
+    from radprompter import __version__
+
+    server_options = {
+        "latency": args.latency,
+        "latency_mean": args.latency_mean,
+        "latency_sigma": args.latency_sigma,
+        "token_rate": args.token_rate,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "seed": 0,
+    }
+    server, api_base = start_server(**server_options)
+    results = []
+    try:
+        grid = [args.concurrency, args.items, args.report_words, args.schemas, args.hide_blocks, args.use_pydantic]
+        for values in itertools.product(*grid):
+            config = dict(zip(SWEEP, values), api_base=api_base, client=args.client, max_attempts=args.max_attempts)
+            print(f"Running {dict(zip(SWEEP, values))}", file=sys.stderr)
+            result = run_configuration(config)
+            results.append({**dict(zip(SWEEP, values)), **result})
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_table(results)
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"{__version__}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "version": __version__,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "client": args.client,
+            "server": server_options,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,42 @@
 """A package for simplified and reproducible LLM prompting."""
 
-from .radprompter import RadPrompter
-from .prompts import Prompt
-from .clients import UniversalClient, HuggingFaceClient, OpenAIClient, AnthropicClient, vLLMClient, OllamaClient, GeminiClient
-from .__version__ import __version__
\ No newline at end of file
+import importlib
+from .__version__ import __version__
+
+# Public names and the modules that define them. They are imported on first access, so that
+# e.g. the command line can parse its arguments without loading the model clients.
+_EXPORTS = {
+    "RadPrompter": ".radprompter",
+    "Prompt": ".prompts",
+    "ResponseCache": ".cache",
+    "Telemetry": ".telemetry",
+    "OutputSink": ".sinks",
+    "CSVSink": ".sinks",
+    "JSONLSink": ".sinks",
+    "ParquetSink": ".sinks",
+    "merge_shards": ".sharding",
+    "Deduplicator": ".dedup",
+    "load_items": ".loaders",
+    "RetryPolicy": ".clients",
+    "UniversalClient": ".clients",
+    "HuggingFaceClient": ".clients",
+    "OpenAIClient": ".clients",
+    "AnthropicClient": ".clients",
+    "vLLMClient": ".clients",
+    "OllamaClient": ".clients",
+    "GeminiClient": ".clients",
+}
+
+__all__ = list(_EXPORTS) + ["__version__"]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .prompts.schemas import get_json_schema
+
+
+class ResponseCache:
+    """
+    Two-tier cache for model responses, keyed on the fully rendered request.
+
+    Lookups go to an in-memory LRU first and fall back to an on-disk SQLite store, which
+    keeps responses across runs. The SQLite tier is trimmed by least-recent access once it
+    grows beyond `max_disk_bytes`. The async methods (`aget`, `aset`) run the SQLite tier on a
+    dedicated thread, so that disk reads and commits do not block the event loop.
+
+    Examples:
+        cache = ResponseCache("radprompter_cache.sqlite")
+        engine = RadPrompter(client=client, prompt=prompt, output_file="output.csv", cache=cache)
+    """
+
+    def __init__(self, path=None, max_memory_items=10000, max_disk_bytes=2**30):
+        """
+        Initialize the cache.
+
+        Args:
+            path (str): Path of the SQLite database. If None, only the in-memory tier is used.
+            max_memory_items (int): Number of responses kept in the in-memory LRU
+            max_disk_bytes (int): Size limit of the stored responses in the SQLite tier
+        """
+        self.path = os.path.abspath(path) if path else None
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bytes_read": 0, "bytes_written": 0, "evictions": 0}
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._executor = None
+        # Access times of disk hits, written with the next commit instead of one commit per read
+        self._touched = {}
+        self._disk_bytes = 0
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints; a crash can lose the latest responses but not corrupt the store
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="radprompter-cache")
+
+    @staticmethod
+    def make_key(model, generation_params, messages, stop=None, max_tokens=None, response_format=None):
+        """
+        Build the cache key of a request.
+
+        Args:
+            model (str): Model name
+            generation_params (dict): Sampling parameters of the client (temperature, seed, ...)
+            messages (list): Rendered message list sent to the model
+            stop (str or list): Stop sequence(s)
+            max_tokens (int): Maximum tokens to generate
+            response_format (type or dict): Pydantic model or JSON schema of the expected response
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        if hasattr(response_format, "model_json_schema"):
+            response_format = get_json_schema(response_format)
+
+        payload = {
+            "model": model,
+            "generation_params": generation_params,
+            "messages": messages,
+            "stop": stop,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+        }
+        serialized = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for `key`, or None on a miss."""
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = self._get_disk(key)
+        return self._count(value)
+
+    async def aget(self, key):
+        """Asynchronous counterpart of `get`."""
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.get_running_loop().run_in_executor(self._executor, self._get_disk, key)
+        return self._count(value)
+
+    def set(self, key, value):
+        """Store `value` (a response string) under `key`."""
+        if not isinstance(value, str):
+            return
+        size = self._set_memory(key, value)
+        if self._db is not None:
+            self._set_disk(key, value, size)
+
+    async def aset(self, key, value):
+        """Asynchronous counterpart of `set`."""
+        if not isinstance(value, str):
+            return
+        size = self._set_memory(key, value)
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._set_disk, key, value, size)
+
+    def _get_memory(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            return value
+
+    def _get_disk(self, key):
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+        with self._lock:
+            self._remember(key, row[0])
+        return row[0]
+
+    def _count(self, value):
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._stats["bytes_read"] += len(value.encode())
+        return value
+
+    def _set_memory(self, key, value):
+        size = len(value.encode())
+        with self._lock:
+            self._remember(key, value)
+            self._stats["bytes_written"] += size
+        return size
+
+    def _set_disk(self, key, value, size):
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._write_touched()
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._disk_bytes += size - (previous[0] if previous else 0)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched.clear()
+
+    def stats(self):
+        """Return a copy of the hit, miss and byte counters."""
+        with self._lock, self._db_lock:
+            return {**self._stats, "memory_items": len(self._memory), "disk_bytes": self._disk_bytes}
+
+    def clear(self):
+        """Drop every cached response from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            if self._db is not None:
+                self._touched.clear()
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._disk_bytes = 0
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._write_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        # Drop the least recently accessed rows until the store is back under 90% of the limit
+        target = int(self.max_disk_bytes * 0.9)
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed ASC")
+        evicted = []
+        for key, size in rows:
+            if self._disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self._disk_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._stats["evictions"] += len(evicted)
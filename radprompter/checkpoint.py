@@ -0,0 +1,143 @@
+import os
+import csv
+import time
+
+
+def scan_output_file(path):
+    """
+    Read an existing output CSV without loading it into memory.
+
+    Args:
+        path (str): Path of the output CSV
+
+    Returns:
+        tuple: (metadata: dict, completed: set of item indices, offset: byte offset right after the last complete row)
+    """
+    metadata = {}
+    completed = set()
+    state = {"position": 0, "terminated": True, "offset": 0}
+
+    with open(path, "rb") as f:
+        def read_lines():
+            in_metadata = True
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                state["position"] = f.tell()
+                state["terminated"] = line.endswith(b"\n")
+                decoded = line.decode("utf-8")
+                if in_metadata and decoded.startswith("#"):
+                    key, _, value = decoded[1:].partition(":")
+                    # Blank lines pad the reserved metadata block
+                    if key.strip():
+                        metadata[key.strip()] = value.strip()
+                    state["offset"] = state["position"]
+                    continue
+                in_metadata = False
+                yield decoded
+
+        reader = csv.reader(read_lines())
+        try:
+            header = next(reader, None)
+            if header is not None and state["terminated"]:
+                state["offset"] = state["position"]
+                for row in reader:
+                    # A row cut short by a crash is either missing fields or its trailing newline
+                    if len(row) != len(header) or not state["terminated"]:
+                        break
+                    try:
+                        completed.add(int(row[0]))
+                    except ValueError:
+                        break
+                    state["offset"] = state["position"]
+        except csv.Error:
+            pass
+
+    return metadata, completed, state["offset"]
+
+
+class Checkpoint:
+    """
+    Append-only sidecar that records which items have been durably written to the output file.
+
+    The first line stores the prompt hash. Every flush appends a line with the byte offset of
+    the output file followed by the indices written since the previous flush, so a killed run
+    loses at most `interval` seconds of work.
+    """
+
+    def __init__(self, output_file, prompt_hash, interval=5.0):
+        self.path = output_file + ".ckpt"
+        self.prompt_hash = prompt_hash
+        self.interval = interval
+        self._file = None
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def load(self):
+        """
+        Read the checkpoint if it exists.
+
+        Returns:
+            dict or None: {"prompt_hash": str, "completed": set, "offset": int}, or None if there is no checkpoint
+        """
+        if not os.path.isfile(self.path):
+            return None
+
+        with open(self.path, "r") as f:
+            lines = f.read().split("\n")
+
+        # The last element is either empty or a partially written record
+        lines = lines[:-1]
+        if not lines or not lines[0].startswith("#Prompt Hash:"):
+            return None
+
+        state = {"prompt_hash": lines[0].split(":", 1)[1].strip(), "completed": set(), "offset": 0}
+        for line in lines[1:]:
+            parts = line.split()
+            if not parts:
+                continue
+            state["offset"] = int(parts[0])
+            state["completed"].update(int(p) for p in parts[1:])
+        return state
+
+    def start(self, offset=0, completed=None):
+        """Create a fresh checkpoint, seeded with the items already present in the output file."""
+        self._file = open(self.path, "w")
+        self._file.write(f"#Prompt Hash: {self.prompt_hash}\n")
+        self._file.write(" ".join(str(i) for i in [offset, *sorted(completed or [])]) + "\n")
+        self._sync()
+        self._last_flush = time.monotonic()
+
+    def add(self, index):
+        """Mark an item as written to the output file (not yet durable)."""
+        self._pending.append(index)
+
+    def time_until_flush(self):
+        """Seconds until the pending indices are due to be made durable, or None if nothing is pending."""
+        if not self._pending:
+            return None
+        return max(self._last_flush + self.interval - time.monotonic(), 0.0)
+
+    def maybe_flush(self, sink, force=False):
+        """Make the output sink and the pending indices durable if `interval` seconds have passed."""
+        if not force and time.monotonic() - self._last_flush < self.interval:
+            return
+
+        offset = sink.sync()
+        if self._file is not None and (self._pending or force):
+            self._file.write(" ".join(str(i) for i in [offset, *self._pending]) + "\n")
+            self._sync()
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def close(self, remove=False):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
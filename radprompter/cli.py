@@ -0,0 +1,185 @@
+"""
+Command line entry point.
+
+Examples:
+    radprompter run prompt.toml --client vllm --model llama --api-base http://localhost:8000/v1 \\
+        --input reports.parquet --output out.parquet --column report=report_text --concurrency 64
+    radprompter run prompt.toml --client openai --model gpt-4o --input sample_reports/ --output out.csv \\
+        --shard-index 0 --num-shards 4
+    radprompter merge out.csv
+"""
+import sys
+import argparse
+from .__version__ import __version__
+
+CLIENTS = ["universal", "vllm", "openai", "anthropic", "gemini", "ollama"]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="radprompter", description="Run RadPrompter prompts over a corpus of reports.")
+    parser.add_argument("--version", action="version", version=f"RadPrompter {__version__}")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run = subparsers.add_parser("run", help="Run a prompt over a corpus")
+    run.add_argument("prompt", help="Prompt TOML file")
+    run.add_argument("--input", required=True, help="CSV, TSV, Parquet or JSONL file, or a directory of .txt reports")
+    run.add_argument("--output", required=True, help="Output file; its extension (.csv, .jsonl, .parquet) selects the format")
+    run.add_argument("--input-format", choices=["csv", "parquet", "jsonl", "txt"], default=None, help="Format of --input (inferred if omitted)")
+    run.add_argument("--output-format", choices=["csv", "jsonl", "parquet"], default=None, help="Format of --output (inferred if omitted)")
+    run.add_argument("--column", action="append", default=[], metavar="PLACEHOLDER=COLUMN", help="Fill a prompt placeholder from an input column, e.g. report=findings_text (repeatable)")
+    run.add_argument("--text-field", default="report", help="Placeholder filled with the content of .txt reports (default: report)")
+    run.add_argument("--chunk-size", type=int, default=1000, help="Rows read at a time from CSV and Parquet inputs")
+
+    client = run.add_argument_group("client")
+    client.add_argument("--client", choices=CLIENTS, default="universal")
+    client.add_argument("--model", required=True)
+    client.add_argument("--api-base", default=None)
+    client.add_argument("--api-key", default=None, help="API key (defaults to the provider's environment variable)")
+    client.add_argument("--temperature", type=float, default=0.0)
+    client.add_argument("--top-p", type=float, default=None)
+    client.add_argument("--seed", type=int, default=None)
+    client.add_argument("--requests-per-minute", type=int, default=None)
+    client.add_argument("--tokens-per-minute", type=int, default=None)
+    client.add_argument("--adaptive-concurrency", action="store_true", help="Adapt the number of in-flight requests to the provider")
+    client.add_argument("--max-attempts", type=int, default=1, help="Attempts per request; failed requests are retried with backoff if > 1")
+    client.add_argument("--deadline", type=float, default=None, help="Seconds allowed per request, retries included")
+    client.add_argument("--stream", action="store_true", help="Stream answers, end them once complete and record the time to first token")
+
+    engine = run.add_argument_group("engine")
+    engine.add_argument("--concurrency", type=int, default=1)
+    engine.add_argument("--max-queued-items", type=int, default=None)
+    engine.add_argument("--hide-blocks", action="store_true")
+    engine.add_argument("--no-pydantic", action="store_true", help="Do not use structured output")
+    engine.add_argument("--max-generation-tokens", type=int, default=4096)
+    engine.add_argument("--schema-groups", action="store_true", help="Extract independent schemas in a single request")
+    engine.add_argument("--prefix-caching", action="store_true")
+    engine.add_argument("--ordered-output", action="store_true", help="Write rows in input order")
+    engine.add_argument("--option-scoring", action="store_true", help="Answer select schemas by scoring their options (vllm client)")
+    engine.add_argument("--deduplicate", action="store_true", help="Process identical items once and copy their results to the duplicates")
+    engine.add_argument("--near-duplicate-threshold", type=float, default=None, help="Also treat items with at least this estimated Jaccard similarity as duplicates")
+    engine.add_argument("--dedup-cache-size", type=int, default=10000, help="Number of recent unique items (and results) kept for later duplicates")
+    engine.add_argument("--cache", default=None, metavar="PATH", help="Response cache (SQLite file)")
+    engine.add_argument("--resume", action="store_true", help="Skip the items already written to --output")
+    engine.add_argument("--shard-index", type=int, default=None)
+    engine.add_argument("--num-shards", type=int, default=None)
+    engine.add_argument("--shard-key", default=None, help="Input field hashed to assign items to shards (default: the whole item)")
+    engine.add_argument("--log", default=None, metavar="PATH", help="Write the run log to PATH")
+    engine.add_argument("--metrics", default=None, metavar="PATH", help="Write Prometheus metrics of the run to PATH")
+    engine.add_argument("--spans", default=None, metavar="PATH", help="Stream one OpenTelemetry-style span per model call to PATH")
+
+    merge = subparsers.add_parser("merge", help="Merge the part files of a sharded run")
+    merge.add_argument("output", help="Output file given to the shards")
+    merge.add_argument("--remove-parts", action="store_true", help="Delete the part files after merging")
+    return parser
+
+
+def parse_columns(values):
+    columns = {}
+    for value in values:
+        placeholder, separator, column = value.partition("=")
+        if not separator or not placeholder or not column:
+            raise ValueError(f"Expected PLACEHOLDER=COLUMN, got {value!r}")
+        columns[placeholder] = column
+    return columns
+
+
+def build_client(args):
+    from . import clients
+
+    client_classes = {
+        "universal": clients.UniversalClient,
+        "vllm": clients.vLLMClient,
+        "openai": clients.OpenAIClient,
+        "anthropic": clients.AnthropicClient,
+        "gemini": clients.GeminiClient,
+        "ollama": clients.OllamaClient,
+    }
+    options = {
+        "api_base": args.api_base,
+        "api_key": args.api_key,
+        "temperature": args.temperature,
+        "seed": args.seed,
+        "requests_per_minute": args.requests_per_minute,
+        "tokens_per_minute": args.tokens_per_minute,
+        "adaptive_concurrency": args.adaptive_concurrency,
+        "stream": args.stream or None,
+    }
+    if args.top_p is not None:
+        options["top_p"] = args.top_p
+    if args.adaptive_concurrency:
+        options["max_concurrency"] = args.concurrency
+    if args.max_attempts > 1 or args.deadline is not None:
+        options["retry_policy"] = clients.RetryPolicy(max_attempts=args.max_attempts, deadline=args.deadline)
+    return client_classes[args.client](args.model, **{key: value for key, value in options.items() if value is not None})
+
+
+def run(args):
+    from .loaders import load_items
+    from .prompts import Prompt
+    from .radprompter import RadPrompter
+
+    columns = parse_columns(args.column)
+    items = load_items(args.input, columns=columns, input_format=args.input_format, text_field=args.text_field, chunk_size=args.chunk_size)
+
+    cache = None
+    if args.cache is not None:
+        from .cache import ResponseCache
+        cache = ResponseCache(args.cache)
+
+    engine = RadPrompter(
+        client=build_client(args),
+        prompt=Prompt(args.prompt),
+        output_file=args.output,
+        hide_blocks=args.hide_blocks,
+        concurrency=args.concurrency,
+        max_generation_tokens=args.max_generation_tokens,
+        use_pydantic=not args.no_pydantic,
+        cache=cache,
+        resume=args.resume,
+        max_queued_items=args.max_queued_items,
+        schema_groups=args.schema_groups,
+        prefix_caching=args.prefix_caching,
+        output_format=args.output_format,
+        ordered_output=args.ordered_output,
+        option_scoring=args.option_scoring,
+        deduplicate=args.deduplicate,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+        dedup_cache_size=args.dedup_cache_size,
+        spans_file=args.spans,
+        shard_index=args.shard_index,
+        num_shards=args.num_shards,
+        shard_key=args.shard_key,
+    )
+    engine(items)
+
+    if args.log is not None:
+        engine.save_log(args.log)
+    if args.metrics is not None:
+        engine.telemetry.write_prometheus(args.metrics)
+    print(f"Wrote {engine.log['Number of Items']} items to {engine.output_file} in {engine.log['Duration']}s", file=sys.stderr)
+
+
+def merge(args):
+    from .sharding import merge_shards
+
+    metadata = merge_shards(args.output, remove_parts=args.remove_parts)
+    print(f"Merged {metadata['Merged Parts']} parts into {args.output}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "run":
+            run(args)
+        else:
+            merge(args)
+    except (ValueError, FileNotFoundError, ImportError) as e:
+        parser.exit(2, f"radprompter: error: {e}\n")
+    except KeyboardInterrupt:
+        parser.exit(130, "radprompter: interrupted\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from .client import Client
+from .retry import RetryPolicy
 from .universal.client import UniversalClient
 from .huggingface.client import HuggingFaceClient
 from .openai.client import OpenAIClient
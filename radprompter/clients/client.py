@@ -1,23 +1,218 @@
+import json
+import math
+import asyncio
+import functools
+import threading
+import contextvars
+from ..telemetry import current_call
+
 class Client():
+    # Whether the client implements `score_options`
+    supports_scoring = False
+
     def __init__(self, model):
         self.model = model
-        
+        # Optional `ResponseCache`, consulted by `ask_model`/`aask_model` before calling the model
+        self.cache = None
+        # Token counters accumulated from the usage payload of every completion
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cache_creation_tokens": 0}
+        self._usage_lock = threading.Lock()
+
     def chat_complete(self, messages, stop, max_tokens=None, response_format=None, **kwargs):
         raise NotImplementedError()
-    
+
+    async def achat_complete(self, messages, stop, max_tokens=None, response_format=None, **kwargs):
+        """
+        Asynchronous counterpart of `chat_complete`.
+
+        Clients without a native async backend fall back to running the blocking
+        `chat_complete` in the event loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the current context so that usage is attributed to the tracked call
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None,
+            context.run,
+            functools.partial(self.chat_complete, messages, stop, max_tokens, response_format=response_format, **kwargs)
+        )
+
     def ask_model(self, messages, stop, max_tokens=200, response_format=None, **kwargs):
         if messages[-1]['role'] == "assistant":
             prefix = messages[-1]['content']
         else:
             prefix = ""
-        response = self.chat_complete(messages, stop, max_tokens, response_format=response_format, **kwargs)
+        cache_key = self.get_cache_key(messages, stop, max_tokens, response_format, **kwargs)
+        response = self.cache.get(cache_key) if cache_key else None
+        if response is not None:
+            self._mark_cache_hit()
+        else:
+            response = self.chat_complete(messages, stop, max_tokens, response_format=response_format, **kwargs)
+            if cache_key:
+                self.cache.set(cache_key, response)
         messages = self.update_last_message(messages, response, prefix=prefix, suffix=stop)
         return response, messages
+
+    async def aask_model(self, messages, stop, max_tokens=200, response_format=None, **kwargs):
+        if messages[-1]['role'] == "assistant":
+            prefix = messages[-1]['content']
+        else:
+            prefix = ""
+        cache_key = self.get_cache_key(messages, stop, max_tokens, response_format, **kwargs)
+        response = await self.cache.aget(cache_key) if cache_key else None
+        if response is not None:
+            self._mark_cache_hit()
+        else:
+            response = await self.achat_complete(messages, stop, max_tokens, response_format=response_format, **kwargs)
+            if cache_key:
+                await self.cache.aset(cache_key, response)
+        messages = self.update_last_message(messages, response, prefix=prefix, suffix=stop)
+        return response, messages
+
+    def score_options(self, messages, options):
+        """
+        Score candidate continuations of a conversation without generating.
+        
+        Args:
+            messages (list): The conversation; a final assistant message is continued
+            options (list): Candidate continuations (strings)
+            
+        Returns:
+            list: The mean log-probability per token of each option, so that options of different
+                  lengths compare fairly
+        """
+        raise NotImplementedError()
+
+    async def ascore_options(self, messages, options):
+        """Asynchronous counterpart of `score_options`."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, functools.partial(self.score_options, messages, options))
+
+    def ask_options(self, messages, options):
+        """
+        Pick the most likely of `options` as the answer, like `ask_model` does for generated text.
+        
+        Returns:
+            tuple: (index of the chosen option, probability of each option, updated messages). The
+                   probabilities are a softmax of the length-normalised scores over the options: a
+                   relative confidence among them, not a calibrated probability.
+        """
+        cache_key = self.get_cache_key(messages, None, response_format={"options": options, "score": "mean_logprob"})
+        scores = self.cache.get(cache_key) if cache_key else None
+        if scores is not None:
+            self._mark_cache_hit()
+            scores = json.loads(scores)
+        else:
+            scores = self.score_options(messages, options)
+            if cache_key:
+                self.cache.set(cache_key, json.dumps(scores))
+        return self._choose_option(messages, options, scores)
+
+    async def aask_options(self, messages, options):
+        """Asynchronous counterpart of `ask_options`."""
+        cache_key = self.get_cache_key(messages, None, response_format={"options": options, "score": "mean_logprob"})
+        scores = await self.cache.aget(cache_key) if cache_key else None
+        if scores is not None:
+            self._mark_cache_hit()
+            scores = json.loads(scores)
+        else:
+            scores = await self.ascore_options(messages, options)
+            if cache_key:
+                await self.cache.aset(cache_key, json.dumps(scores))
+        return self._choose_option(messages, options, scores)
+
+    def _choose_option(self, messages, options, scores):
+        # Softmax of the per-token scores over the options, i.e. the relative weight of each option given that the answer is one of them
+        highest = max(scores)
+        weights = [math.exp(score - highest) for score in scores]
+        probabilities = [weight / sum(weights) for weight in weights]
+        best = probabilities.index(max(probabilities))
+        prefix = messages[-1]['content'] if messages[-1]['role'] == "assistant" else ""
+        messages = self.update_last_message(messages, options[best], prefix=prefix)
+        return best, probabilities, messages
+
+    def build_user_content(self, prefix, tail):
+        """
+        Build the content of a user message made of a prefix shared by every schema of an item
+        and a schema-specific tail. Providers with explicit prompt caching mark the prefix.
+        """
+        return prefix + tail
+
+    def record_usage(self, usage, cost=None):
+        """
+        Accumulate the token counts of a completion's usage payload (as returned by LiteLLM).
+        
+        The counts (and the estimated cost, if known) are also added to the call tracked by the
+        engine's telemetry, if any.
+        """
+        if usage is None:
+            return
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        counts = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+            "cached_tokens": getattr(prompt_tokens_details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        }
+        with self._usage_lock:
+            for key, value in counts.items():
+                self.usage[key] += value
         
+        call = current_call.get()
+        if call is not None:
+            # Hedged or retried calls may report usage more than once
+            for key, value in [*counts.items(), ("cost", cost or 0.0)]:
+                call[key] = call.get(key, 0) + value
+
+    def record_timing(self, time_to_first_token, time_to_complete, early_stop=False):
+        """
+        Add the timings of a streamed completion to the call tracked by the engine's telemetry, if any.
+
+        Args:
+            time_to_first_token (float): Seconds from sending the request to the first answer text (None if there was none)
+            time_to_complete (float): Seconds from sending the request to the complete answer
+            early_stop (bool): Whether the stream was closed before the provider ended it
+        """
+        call = current_call.get()
+        if call is not None:
+            # With retries or hedging, the timings of the last (successful) attempt are kept
+            call["time_to_first_token"] = time_to_first_token
+            call["time_to_complete"] = time_to_complete
+            call["early_stop"] = early_stop
+
+    def _mark_cache_hit(self):
+        call = current_call.get()
+        if call is not None:
+            call["cache_hit"] = True
+
+    def get_generation_params(self):
+        """Return the sampling parameters that influence the generated text."""
+        params = {
+            name: getattr(self, name)
+            for name in ["temperature", "top_p", "seed", "frequency_penalty", "presence_penalty"]
+            if hasattr(self, name)
+        }
+        params.update(getattr(self, "extra_kwargs", {}))
+        return params
+
+    def get_cache_key(self, messages, stop, max_tokens=None, response_format=None, **kwargs):
+        """Return the cache key of a request, or None when no cache is attached."""
+        if self.cache is None:
+            return None
+        return self.cache.make_key(
+            self.model,
+            {**self.get_generation_params(), **kwargs},
+            messages,
+            stop=stop,
+            max_tokens=max_tokens,
+            response_format=response_format,
+        )
+
     def update_last_message(self, messages, response, prefix=None, suffix=None):
         if messages[-1]['role'] == "assistant":
             messages[-1]['content'] += (prefix if prefix else "") + response + (suffix if suffix else "")
         else:
             # If the last message is not an assistant message, add a new assistant message (there is no prefix)
             messages.append({"role": "assistant", "content": response + (suffix if suffix else "")})
-        return messages
\ No newline at end of file
+        return messages
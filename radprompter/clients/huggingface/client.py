@@ -1,7 +1,14 @@
 from ..client import Client
+from .constrained import JSONSchemaFSM, TokenVocabulary, TokenFSM, JSONSchemaLogitsProcessor
+from ...prompts.schemas import get_json_schema
 import os
+import json
+import asyncio
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
 try:
-    from transformers import StoppingCriteria, StoppingCriteriaList, set_seed # type: ignore
+    from transformers import StoppingCriteria, StoppingCriteriaList, LogitsProcessorList, set_seed # type: ignore
     import torch # type: ignore
     os.environ['HAS_TRANSFORMERS'] = str(True)
 except ImportError:
@@ -9,24 +16,193 @@ except ImportError:
     StoppingCriteria = ABC
     os.environ['HAS_TRANSFORMERS'] = str(False)
 
+def normalize_stop_strings(stop):
+    """Return the stop argument of a request (None, a string or a list of strings) as a list."""
+    if not stop:
+        return []
+    if isinstance(stop, str):
+        return [stop]
+    return [s for s in stop if s]
+
+class StopStringAutomaton:
+    """
+    Token-level Aho-Corasick automaton over a set of stop strings.
+    
+    A character-level automaton is built over all stop strings and lifted to the vocabulary:
+    `transitions[state, token]` is the state after reading the token's text and
+    `matches[state, token]` is the bitmask of stop strings completed while reading it. One
+    decode step is then a single gather, whatever the number of stop strings, and matches
+    spanning several tokens are detected exactly and in order.
+    """
+    
+    def __init__(self, stop_strings, tokenizer, vocabulary=None):
+        """
+        Args:
+            stop_strings (list): Stop strings, matched in this order (bit `i` of a match is `stop_strings[i]`)
+            tokenizer: Hugging Face tokenizer
+            vocabulary (TokenVocabulary): Decoded tokens of `tokenizer`, built if not given
+        """
+        self.stop_strings = list(stop_strings)
+        assert len(self.stop_strings) < 63, "At most 62 distinct stop strings are supported."
+        
+        # Character-level trie with failure links
+        goto, fail, output = [{}], [0], [0]
+        for bit, stop_string in enumerate(self.stop_strings):
+            state = 0
+            for char in stop_string:
+                if char not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    output.append(0)
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            output[state] |= 1 << bit
+        
+        queue = list(goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for char, child in goto[state].items():
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(char, 0) if goto[fallback].get(char, 0) != child else 0
+                output[child] |= output[fail[child]]
+                queue.append(child)
+        
+        def step(state, char):
+            while state and char not in goto[state]:
+                state = fail[state]
+            return goto[state].get(char, 0)
+        
+        # Full character-level DFA; column 0 stands for any character outside the stop strings
+        alphabet = sorted(set("".join(self.stop_strings)))
+        char_index = {char: i + 1 for i, char in enumerate(alphabet)}
+        num_states = len(goto)
+        dfa = torch.tensor([[0] + [step(state, char) for char in alphabet] for state in range(num_states)], dtype=torch.long)
+        output = torch.tensor(output, dtype=torch.long)
+        
+        # Lift to tokens; tokens sharing no character with any stop string always lead back to the root
+        # Token texts come from `TokenVocabulary`, which keeps the leading space of SentencePiece tokens
+        if vocabulary is None:
+            vocabulary = TokenVocabulary(tokenizer, [])
+        vocab_size = vocabulary.size
+        token_strings = [text or "" for text in vocabulary.token_strings]
+        for token_id in tokenizer.all_special_ids:
+            if token_id < vocab_size:
+                token_strings[token_id] = tokenizer.decode([token_id])
+        relevant = [token_id for token_id, token_string in enumerate(token_strings) if not char_index.keys().isdisjoint(token_string)]
+        relevant.sort(key=lambda token_id: len(token_strings[token_id]), reverse=True)
+        
+        transitions = torch.zeros((num_states, vocab_size), dtype=torch.long)
+        matches = torch.zeros((num_states, vocab_size), dtype=torch.long)
+        if relevant:
+            lengths = torch.tensor([len(token_strings[token_id]) for token_id in relevant])
+            chars = torch.zeros((len(relevant), int(lengths[0])), dtype=torch.long)
+            for row, token_id in enumerate(relevant):
+                token_chars = [char_index.get(char, 0) for char in token_strings[token_id]]
+                chars[row, :len(token_chars)] = torch.tensor(token_chars, dtype=torch.long)
+            
+            # Run every start state through every token at once, one character position at a time;
+            # tokens are sorted by length so the ones still being read form a prefix of the columns
+            states = torch.arange(num_states).unsqueeze(1).repeat(1, len(relevant))
+            matched = torch.zeros_like(states)
+            for position in range(chars.shape[1]):
+                active = int((lengths > position).sum())
+                states[:, :active] = dfa[states[:, :active], chars[:active, position].unsqueeze(0)]
+                matched[:, :active] |= output[states[:, :active]]
+            
+            relevant = torch.tensor(relevant, dtype=torch.long)
+            transitions[:, relevant] = states
+            matches[:, relevant] = matched
+        
+        self.transitions = transitions
+        self.matches = matches
+    
+    def get_bitmask(self, stop_strings):
+        """Return the bitmask selecting `stop_strings` among the automaton's stop strings."""
+        bitmask = 0
+        for stop_string in stop_strings:
+            bitmask |= 1 << self.stop_strings.index(stop_string)
+        return bitmask
+    
+    def to(self, device):
+        if self.transitions.device != device:
+            self.transitions = self.transitions.to(device)
+            self.matches = self.matches.to(device)
+        return self
+
 class StopStringCriteria(StoppingCriteria):
-    def __init__(self, stop_string, tokenizer):
-        self.stop_string = stop_string
-        self.tokenizer = tokenizer
-        self.stop_ids = tokenizer.encode(stop_string, add_special_tokens=False)
+    """
+    Batch-aware stopping criterion returning a per-row done mask.
+    
+    Each row of the batch has its own stop strings and optionally its own token budget, so
+    finished rows stop early while the rest of the batch keeps generating.
+    """
+    
+    def __init__(self, row_stop_strings, automaton, row_max_new_tokens=None):
+        """
+        Args:
+            row_stop_strings (list): Stop strings of each row (None, a string or a list of strings)
+            automaton (StopStringAutomaton): Automaton compiled over (at least) all of these stop strings
+            row_max_new_tokens (list): Optional token budget of each row
+        """
+        self.automaton = automaton
+        self.row_bitmasks = torch.tensor([automaton.get_bitmask(normalize_stop_strings(stop)) for stop in row_stop_strings], dtype=torch.long)
+        self.row_max_new_tokens = torch.tensor(row_max_new_tokens, dtype=torch.long) if row_max_new_tokens is not None else None
+        self.state = None
+        self.done = None
+        self.num_generated = 0
+        self._length = None
 
     def __call__(self, input_ids, scores, **kwargs):
-        # Check if the last generated tokens match the stop string tokens
-        if input_ids.shape[1] < len(self.stop_ids):
-            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
-
-        for stop_id in self.stop_ids:
-            if stop_id not in input_ids[0, -len(self.stop_ids):]:
-                return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if self.state is None or input_ids.shape[1] != self._length + 1:
+            # First decode step of a `generate` call
+            device = input_ids.device
+            self.automaton.to(device)
+            self.row_bitmasks = self.row_bitmasks.to(device)
+            if self.row_max_new_tokens is not None:
+                self.row_max_new_tokens = self.row_max_new_tokens.to(device)
+            self.state = torch.zeros(input_ids.shape[0], dtype=torch.long, device=device)
+            self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=device)
+            self.num_generated = 0
+        
+        self._length = input_ids.shape[1]
+        self.num_generated += 1
+        last_tokens = input_ids[:, -1]
+        
+        matched = self.automaton.matches[self.state, last_tokens] & self.row_bitmasks
+        self.state = self.automaton.transitions[self.state, last_tokens]
+        self.done |= matched != 0
+        if self.row_max_new_tokens is not None:
+            self.done |= self.row_max_new_tokens <= self.num_generated
         
-        return torch.ones(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        return self.done.clone()
 
 class HuggingFaceClient(Client):
+    """
+    Client for local Hugging Face `transformers` models.
+    
+    With `batch_size > 1`, concurrent requests (from several items or schemas) are collected
+    for up to `max_batch_wait` seconds into a left-padded batch and answered by a single
+    `generate` call, so the engine can run with `concurrency > 1`.
+    
+    With `constrained_decoding=True`, requests with a `response_format` (a Pydantic model or its
+    JSON schema) are decoded under a token-level automaton compiled from the schema: every answer
+    is a valid JSON object and generation stops as soon as the object is closed. Automata are
+    compiled once per schema and kept on the client.
+    
+    Examples:
+        client = HuggingFaceClient(hf_model=model, hf_tokenizer=tokenizer, temperature=0.0)
+        
+        # Batched generation
+        client = HuggingFaceClient(hf_model=model, hf_tokenizer=tokenizer, batch_size=8, max_batch_wait=0.05)
+        
+        # Structured output with `use_pydantic=True` in the engine
+        client = HuggingFaceClient(hf_model=model, hf_tokenizer=tokenizer, constrained_decoding=True)
+    """
+    
+    supports_scoring = True
+    
     def __init__(self, hf_model, hf_tokenizer, **kwargs):
         if os.environ['HAS_TRANSFORMERS'] != "True":
             raise ImportError("HuggingFaceClient requires the `transformers` package to be installed.")
@@ -38,46 +214,205 @@ class HuggingFaceClient(Client):
         self.top_p = kwargs.pop("top_p", 0.9)
         self.seed = kwargs.pop("seed", None)
         self.frequency_penalty = kwargs.pop("frequency_penalty", 0.0)
+        self.max_tokens = kwargs.pop("max_tokens", 4096)
+        self.batch_size = kwargs.pop("batch_size", 1)
+        self.max_batch_wait = kwargs.pop("max_batch_wait", 0.05)
+        self.constrained_decoding = kwargs.pop("constrained_decoding", False)
         self.model_device = next(self.hf_model.parameters()).device
 
+        if self.hf_tokenizer.pad_token is None:
+            self.hf_tokenizer.pad_token = self.hf_tokenizer.eos_token
+
+        # `generate` calls are serialised on a single worker thread
+        self._generation_executor = ThreadPoolExecutor(max_workers=1)
+        self._batch_queue = None
+        self._batch_loop = None
+        self._batch_worker = None
+        # Stop string automaton compiled for this tokenizer (see `get_stop_automaton`)
+        self._stop_automaton = None
+        # Token vocabulary and the JSON automata compiled for it, by schema (see `get_json_automaton`)
+        self._vocabulary = None
+        self._json_automata = {}
+
         self.provider = "huggingface"
         
         super().__init__(model_name)
         
     def chat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
-        if self.seed:
-            set_seed(self.seed)
+        return self.generate_batch([(messages, stop, max_tokens, response_format)])[0]
+    
+    async def achat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.batch_size <= 1:
+            return await loop.run_in_executor(self._generation_executor, functools.partial(self.chat_complete, messages, stop, max_tokens, response_format))
+        
+        # The batch queue is bound to the event loop it was created on
+        if self._batch_loop is not loop:
+            self._batch_queue = asyncio.Queue()
+            self._batch_loop = loop
+            self._batch_worker = loop.create_task(self._run_batches(self._batch_queue))
+        
+        future = loop.create_future()
+        await self._batch_queue.put(((messages, stop, max_tokens, response_format), future))
+        return await future
+    
+    async def _run_batches(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
             
-        if max_tokens is None:
-            max_tokens = self.max_tokens
-
+            try:
+                answers = await loop.run_in_executor(self._generation_executor, self.generate_batch, [request for request, _ in batch])
+                for (_, future), answer in zip(batch, answers):
+                    if not future.done():
+                        future.set_result(answer)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def apply_chat_template(self, messages):
+        """Render a conversation as the prompt text the model continues."""
         if messages[-1]['role'] == "assistant":
             # Use continue_final_message=True to properly handle turn tokens
-            tokenized_chat = self.hf_tokenizer.apply_chat_template(
-                messages, 
-                return_dict=True, 
-                continue_final_message=True, 
-                return_tensors="pt"
-            )
-        else:
-            tokenized_chat = self.hf_tokenizer.apply_chat_template(
-                messages, 
-                return_dict=True, 
-                add_generation_prompt=True, 
-                return_tensors="pt"
-            )
-
+            return self.hf_tokenizer.apply_chat_template(messages, tokenize=False, continue_final_message=True)
+        return self.hf_tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    
+    def score_options(self, messages, options):
+        """
+        Score candidate continuations with a single batched forward pass (no generation).
+        
+        Args:
+            messages (list): The conversation; a final assistant message is continued
+            options (list): Candidate continuations (strings)
+            
+        Returns:
+            list: The log-probability of each option's tokens, summed and divided by their number
+        """
+        prompt_ids = self.hf_tokenizer(self.apply_chat_template(messages), add_special_tokens=False)["input_ids"]
+        option_ids = [self.hf_tokenizer(option, add_special_tokens=False)["input_ids"] for option in options]
+        longest = max(len(ids) for ids in option_ids)
+        
+        # Right padding keeps the prompt at the same positions in every row
+        input_ids = torch.full((len(options), len(prompt_ids) + longest), self.hf_tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, ids in enumerate(option_ids):
+            input_ids[row, :len(prompt_ids) + len(ids)] = torch.tensor(prompt_ids + ids, dtype=torch.long)
+            attention_mask[row, :len(prompt_ids) + len(ids)] = 1
+        
+        inputs = {"input_ids": input_ids.to(self.model_device), "attention_mask": attention_mask.to(self.model_device)}
+        if "logits_to_keep" in inspect.signature(self.hf_model.forward).parameters:
+            # Only the positions predicting the option tokens need logits
+            inputs["logits_to_keep"] = longest + 1
+        with torch.no_grad():
+            logits = self.hf_model(**inputs).logits[:, -longest - 1:-1]
+        log_probs = logits.float().log_softmax(-1).cpu()
+        
+        # Length-normalised, so that options with more tokens are not penalised
+        return [
+            float(log_probs[row, torch.arange(len(ids)), torch.tensor(ids, dtype=torch.long)].sum()) / max(len(ids), 1)
+            for row, ids in enumerate(option_ids)
+        ]
+    
+    async def ascore_options(self, messages, options):
+        # Forward passes share the worker thread of `generate` calls
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._generation_executor, functools.partial(self.score_options, messages, options))
+    
+    def get_stop_automaton(self, stop_strings):
+        """
+        Return an automaton covering `stop_strings`.
+        
+        A single automaton is kept per client; it is only recompiled (over all stop strings seen
+        so far) when a batch brings a stop string it does not know yet.
+        """
+        known = set(self._stop_automaton.stop_strings) if self._stop_automaton is not None else set()
+        if not set(stop_strings) <= known:
+            self._stop_automaton = StopStringAutomaton(sorted(known | set(stop_strings)), self.hf_tokenizer, self.get_vocabulary())
+        return self._stop_automaton
+    
+    def get_json_automaton(self, response_format):
+        """
+        Return the token-level automaton of a response format, compiled on first use.
+        
+        Args:
+            response_format (type or dict): Pydantic model or JSON schema of the expected answer
+        """
+        json_schema = get_json_schema(response_format) if hasattr(response_format, "model_json_schema") else response_format
+        key = json.dumps(json_schema, sort_keys=True)
+        automaton = self._json_automata.get(key)
+        if automaton is None:
+            automaton = self._json_automata[key] = TokenFSM(JSONSchemaFSM(json_schema), self.get_vocabulary())
+        return automaton
+    
+    def get_vocabulary(self):
+        """Return the decoded vocabulary shared by the stop-string and JSON automata, built on first use."""
+        if self._vocabulary is None:
+            eos_token_ids = self.hf_model.generation_config.eos_token_id
+            if not isinstance(eos_token_ids, list):
+                eos_token_ids = [eos_token_ids] if eos_token_ids is not None else []
+            self._vocabulary = TokenVocabulary(self.hf_tokenizer, eos_token_ids + [self.hf_tokenizer.eos_token_id])
+        return self._vocabulary
+    
+    def generate_batch(self, requests):
+        """
+        Answer several requests with a single `generate` call.
+        
+        Args:
+            requests (list): List of (messages, stop, max_tokens, response_format) tuples; every row has its own stop
+                             strings, token budget and (with `constrained_decoding`) response format
+            
+        Returns:
+            list: The generated response text of each request
+        """
+        if self.seed:
+            set_seed(self.seed)
+        
+        row_stop_strings = [normalize_stop_strings(stop) for _, stop, _, _ in requests]
+        row_max_tokens = [max_tokens if max_tokens is not None else self.max_tokens for _, _, max_tokens, _ in requests]
+        row_automata = [
+            self.get_json_automaton(response_format) if self.constrained_decoding and response_format else None
+            for _, _, _, response_format in requests
+        ]
+        
+        prompts = [self.apply_chat_template(messages) for messages, _, _, _ in requests]
+        
+        # Left padding keeps the generated tokens of every row aligned at the end of the prompt
+        padding_side = self.hf_tokenizer.padding_side
+        self.hf_tokenizer.padding_side = "left"
+        try:
+            tokenized_chat = self.hf_tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False)
+        finally:
+            self.hf_tokenizer.padding_side = padding_side
+        
         tokenized_chat = {k: v.to(self.model_device) for k, v in tokenized_chat.items()}
 
         stopping_criteria_list = StoppingCriteriaList()
-        if stop:
-            stopping_criteria_list.append(StopStringCriteria(stop, self.hf_tokenizer))
+        all_stop_strings = [stop for stops in row_stop_strings for stop in stops]
+        if all_stop_strings or len(set(row_max_tokens)) > 1:
+            stopping_criteria_list.append(StopStringCriteria(
+                row_stop_strings,
+                self.get_stop_automaton(all_stop_strings),
+                row_max_new_tokens=row_max_tokens if len(set(row_max_tokens)) > 1 else None,
+            ))
 
         generation_kwargs = {
-            "max_new_tokens": max_tokens,
+            "max_new_tokens": max(row_max_tokens),
             "num_return_sequences": 1,
-            "stopping_criteria": stopping_criteria_list
+            "stopping_criteria": stopping_criteria_list,
+            "pad_token_id": self.hf_tokenizer.pad_token_id,
         }
+        if any(automaton is not None for automaton in row_automata):
+            generation_kwargs["logits_processor"] = LogitsProcessorList([JSONSchemaLogitsProcessor(row_automata)])
         
         if self.temperature == 0:
             generation_kwargs["do_sample"] = False
@@ -95,7 +430,13 @@ class HuggingFaceClient(Client):
         )
 
         prompt_size = tokenized_chat['input_ids'].size(-1)
-        answer_tokens = outputs[0, prompt_size:]
-        answer_text = self.hf_tokenizer.decode(answer_tokens, skip_special_tokens=True)
-
-        return answer_text
\ No newline at end of file
+        answers = self.hf_tokenizer.batch_decode(outputs[:, prompt_size:], skip_special_tokens=True)
+        
+        # Cut every row right after the first of its stop strings, in case the stop string was
+        # completed inside a token that carried extra text
+        for row, stops in enumerate(row_stop_strings):
+            ends = [answers[row].find(stop) + len(stop) for stop in stops if stop in answers[row]]
+            if ends:
+                answers[row] = answers[row][:min(ends)]
+        
+        return answers
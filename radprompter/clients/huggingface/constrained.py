@@ -0,0 +1,278 @@
+import os
+import json
+try:
+    from transformers import LogitsProcessor # type: ignore
+    import torch # type: ignore
+    os.environ['HAS_TRANSFORMERS'] = str(True)
+except ImportError:
+    from abc import ABC
+    LogitsProcessor = ABC
+    os.environ['HAS_TRANSFORMERS'] = str(False)
+
+# Longest integer part and fraction accepted for `int` and `float` answers, so that every answer ends
+MAX_NUMBER_DIGITS = 15
+JSON_ESCAPES = '"\\/bfnrt'
+HEX_DIGITS = "0123456789abcdefABCDEF"
+
+
+class JSONSchemaFSM:
+    """
+    Character-level automaton accepting the JSON objects of a flat Pydantic JSON schema.
+
+    Objects are laid out canonically, i.e. `{"Field A": "Option", "Field B": 12}` with the fields
+    in schema order. Fields may be enums of strings (select), integers, numbers or free strings.
+    Every state has explicit transitions per character and, inside strings, a `default`
+    transition taken by any other (non-control) character.
+    """
+
+    def __init__(self, json_schema):
+        """
+        Args:
+            json_schema (dict): JSON schema of a Pydantic model, e.g. `model.model_json_schema()`
+
+        Raises:
+            ValueError: If the schema uses types that cannot be compiled
+        """
+        self.transitions = []
+        self.defaults = []
+        definitions = json_schema.get("$defs", {})
+        properties = json_schema.get("properties", {})
+        if json_schema.get("type") != "object" or not properties:
+            raise ValueError("Constrained decoding requires a JSON schema of an object with properties.")
+
+        self.initial_state = self._add_state()
+        exits = [self.initial_state]
+        for i, (name, field) in enumerate(properties.items()):
+            exits = self._add_literal(exits, ("{" if i == 0 else ", ") + json.dumps(name) + ": ")
+            exits = self._add_value(exits, self._resolve(field, definitions))
+        self.final_state = self._add_literal(exits, "}")[0]
+
+    def _add_state(self):
+        self.transitions.append({})
+        self.defaults.append(None)
+        return len(self.transitions) - 1
+
+    def _add_transition(self, states, char, target=None):
+        """Add a transition on `char` from all `states` to a common (new or shared) target state."""
+        for state in states:
+            if char in self.transitions[state]:
+                target = self.transitions[state][char] if target is None else target
+        if target is None:
+            target = self._add_state()
+        for state in states:
+            self.transitions[state][char] = target
+        return target
+
+    def _add_literal(self, states, text):
+        for char in text:
+            states = [self._add_transition(states, char)]
+        return states
+
+    @staticmethod
+    def _resolve(field, definitions):
+        while True:
+            if "$ref" in field:
+                field = definitions[field["$ref"].split("/")[-1]]
+            elif "allOf" in field and len(field["allOf"]) == 1:
+                field = field["allOf"][0]
+            else:
+                return field
+
+    def _add_value(self, states, field):
+        if "enum" in field:
+            return self._add_enum(states, field["enum"])
+        if field.get("type") == "integer":
+            return self._add_number(states, fraction=False)
+        if field.get("type") == "number":
+            return self._add_number(states, fraction=True)
+        if field.get("type") == "string":
+            return self._add_string(states)
+        raise ValueError(f"Cannot compile JSON schema field {field} for constrained decoding.")
+
+    def _add_enum(self, states, options):
+        # Encoded options end with a closing quote, so none is a prefix of another and they share the end state
+        end = self._add_state()
+        for option in options:
+            encoded = json.dumps(option)
+            current = states
+            for char in encoded[:-1]:
+                current = [self._add_transition(current, char)]
+            self._add_transition(current, encoded[-1], end)
+        return [end]
+
+    def _add_number(self, states, fraction):
+        sign = self._add_transition(states, "-")
+        zero = self._add_state()
+        for state in states + [sign]:
+            self.transitions[state]["0"] = zero
+        # `digits[k]` has read k + 1 digits of the integer part
+        digits = [self._add_state() for _ in range(MAX_NUMBER_DIGITS)]
+        for state in states + [sign]:
+            for char in "123456789":
+                self.transitions[state][char] = digits[0]
+        for previous, state in zip(digits, digits[1:]):
+            for char in "0123456789":
+                self.transitions[previous][char] = state
+        exits = [zero] + digits
+        if fraction:
+            point = self._add_transition([zero] + digits, ".")
+            decimals = [self._add_state() for _ in range(MAX_NUMBER_DIGITS)]
+            for previous, state in zip([point] + decimals, decimals):
+                for char in "0123456789":
+                    self.transitions[previous][char] = state
+            exits += decimals
+        return exits
+
+    def _add_string(self, states):
+        content = self._add_transition(states, '"')
+        end = self._add_state()
+        escape = self._add_state()
+        self.transitions[content]['"'] = end
+        self.transitions[content]["\\"] = escape
+        self.defaults[content] = content
+        for char in JSON_ESCAPES:
+            self.transitions[escape][char] = content
+        current = [self._add_transition([escape], "u")]
+        for i in range(4):
+            target = content if i == 3 else self._add_state()
+            for char in HEX_DIGITS:
+                self.transitions[current[0]][char] = target
+            current = [target]
+        return [end]
+
+    def step(self, state, char):
+        """Return the state after reading `char`, or None if the character is not allowed."""
+        target = self.transitions[state].get(char)
+        if target is None and self.defaults[state] is not None and char >= " ":
+            target = self.defaults[state]
+        return target
+
+
+class TokenVocabulary:
+    """Decoded text of every token of a tokenizer, as used to lift character automata to tokens."""
+
+    def __init__(self, tokenizer, eos_token_ids):
+        """
+        Args:
+            tokenizer: Hugging Face tokenizer
+            eos_token_ids (list): Tokens that end generation, allowed once an object is complete
+        """
+        vocab_size = len(tokenizer)
+        # Tokens are decoded after an anchor, so that SentencePiece tokens keep their leading space
+        anchor = tokenizer.encode("a", add_special_tokens=False)[-1:]
+        anchor_text = tokenizer.decode(anchor)
+        decoded = tokenizer.batch_decode([anchor + [token_id] for token_id in range(vocab_size)])
+        special_ids = set(tokenizer.all_special_ids)
+
+        self.size = vocab_size
+        self.eos_token_ids = sorted(set(eos_token_ids))
+        self.token_strings = [None] * vocab_size
+        self.tokens_by_first_char = {}
+        for token_id, text in enumerate(decoded):
+            if token_id in special_ids or not text.startswith(anchor_text):
+                continue
+            text = text[len(anchor_text):]
+            # Tokens holding part of a multi-byte character decode to the replacement character
+            if not text or "\ufffd" in text:
+                continue
+            self.token_strings[token_id] = text
+            self.tokens_by_first_char.setdefault(text[0], []).append(token_id)
+
+
+class TokenFSM:
+    """
+    Token-level view of a `JSONSchemaFSM` for one tokenizer.
+
+    The tokens allowed in a state (and the states they lead to) are computed the first time the
+    state is reached and kept, so that later generations with the same schema only pay for a
+    dictionary lookup per decode step.
+    """
+
+    def __init__(self, char_fsm, vocabulary):
+        self.char_fsm = char_fsm
+        self.vocabulary = vocabulary
+        self.initial_state = char_fsm.initial_state
+        self.final_state = char_fsm.final_state
+        self._next_states = {}
+        self._allowed = {}
+
+    def get_next_states(self, state):
+        """Return {token_id: next state} for the tokens allowed in `state`."""
+        next_states = self._next_states.get(state)
+        if next_states is not None:
+            return next_states
+
+        next_states = {}
+        if state == self.final_state:
+            next_states = {token_id: state for token_id in self.vocabulary.eos_token_ids}
+        else:
+            fsm = self.char_fsm
+            token_strings = self.vocabulary.token_strings
+            if fsm.defaults[state] is not None:
+                candidates = (token_id for token_id, text in enumerate(token_strings) if text is not None)
+            else:
+                candidates = (token_id for char in fsm.transitions[state] for token_id in self.vocabulary.tokens_by_first_char.get(char, []))
+            for token_id in candidates:
+                current = state
+                for char in token_strings[token_id]:
+                    # Nothing may follow the closing brace within the same token
+                    current = fsm.step(current, char) if current != self.final_state else None
+                    if current is None:
+                        break
+                if current is not None:
+                    next_states[token_id] = current
+            if not next_states:
+                # The vocabulary cannot continue the object (e.g. a character without a token): give up on it
+                next_states = {token_id: self.final_state for token_id in self.vocabulary.eos_token_ids}
+
+        self._next_states[state] = next_states
+        return next_states
+
+    def get_allowed_tokens(self, state, device):
+        """Return the allowed token ids of `state` as a tensor on `device`."""
+        allowed = self._allowed.get((state, device))
+        if allowed is None:
+            allowed = torch.tensor(sorted(self.get_next_states(state)), dtype=torch.long, device=device)
+            self._allowed[(state, device)] = allowed
+        return allowed
+
+
+class JSONSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Batch-aware logits processor restricting each row to the tokens allowed by its `TokenFSM`.
+
+    Rows without an automaton (None) are left unconstrained. A constrained row can only emit an
+    end-of-sequence token once its object is complete, so it stops right after the closing brace.
+    """
+
+    def __init__(self, row_fsms):
+        self.row_fsms = row_fsms
+        self.states = None
+        self._length = None
+
+    def __call__(self, input_ids, scores):
+        if self.states is None or input_ids.shape[1] != self._length + 1:
+            # First decode step of a `generate` call
+            self.states = [fsm.initial_state if fsm is not None else None for fsm in self.row_fsms]
+        else:
+            last_tokens = input_ids[:, -1].tolist()
+            for row, fsm in enumerate(self.row_fsms):
+                if fsm is not None and self.states[row] != fsm.final_state:
+                    # An unexpected token (e.g. from a finished row) ends the object
+                    self.states[row] = fsm.get_next_states(self.states[row]).get(last_tokens[row], fsm.final_state)
+        self._length = input_ids.shape[1]
+
+        mask = None
+        for row, fsm in enumerate(self.row_fsms):
+            if fsm is None:
+                continue
+            if mask is None:
+                mask = torch.full_like(scores, float("-inf"))
+            allowed = fsm.get_allowed_tokens(self.states[row], scores.device)
+            allowed = allowed[allowed < scores.shape[-1]]
+            mask[row, allowed] = 0
+        if mask is None:
+            return scores
+        constrained = torch.tensor([fsm is not None for fsm in self.row_fsms], device=scores.device)
+        mask[~constrained] = 0
+        return scores + mask
@@ -0,0 +1,221 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+# HTTP status codes that signal the provider is rate limiting or overloaded
+OVERLOAD_STATUS_CODES = [408, 429, 503, 529]
+
+
+def is_overload_error(error):
+    """Return True if an exception (or the exception it wraps) is a rate-limit or overload response."""
+    while error is not None:
+        if getattr(error, "status_code", None) in OVERLOAD_STATUS_CODES:
+            return True
+        # HTTP client errors (e.g. httpx) carry the status code on their response
+        if getattr(getattr(error, "response", None), "status_code", None) in OVERLOAD_STATUS_CODES:
+            return True
+        if type(error).__name__ in ["RateLimitError", "ServiceUnavailableError", "Timeout"]:
+            return True
+        error = error.__cause__
+    return False
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`, holding at most one minute of budget.
+
+    Callers reserve their cost upfront and the bucket is allowed to go into debt: the returned
+    wait is the time until the debt is repaid, so concurrent callers are served in order.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Take `amount` from the bucket and return the number of seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def drain(self):
+        """Drop any remaining budget, e.g. after the provider reported a rate limit."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits of a provider.
+
+    Prompt tokens are reserved before a request is sent, completion tokens are charged once
+    the response reports them.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            requests_per_minute (int): Maximum number of requests per minute
+            tokens_per_minute (int): Maximum number of prompt + completion tokens per minute
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens=0):
+        """Reserve one request and `tokens` prompt tokens, returning the number of seconds to wait."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        time.sleep(self.reserve(tokens))
+
+    async def aacquire(self, tokens=0):
+        await asyncio.sleep(self.reserve(tokens))
+
+    def charge(self, tokens):
+        """Charge tokens that were only known after the request (e.g. completion tokens)."""
+        if self.tokens is not None and tokens:
+            self.tokens.reserve(tokens)
+
+    def drain(self):
+        for bucket in [self.requests, self.tokens]:
+            if bucket is not None:
+                bucket.drain()
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the number of in-flight requests.
+
+    While the limit is fully used and latency stays within `latency_tolerance` times the best
+    latency seen so far, the limit grows by one per window of `limit` successful requests.
+    A rate-limit or overload response multiplies it by `backoff`, at most once per round trip.
+    Slots are taken with `acquire` from async code and with `acquire_blocking` from threads.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=256, backoff=0.5, latency_tolerance=2.0, error_tolerance=0.05):
+        """
+        Args:
+            initial (int): Starting limit
+            min_limit (int): Lower bound of the limit
+            max_limit (int): Upper bound of the limit
+            backoff (float): Factor applied to the limit on rate-limit or overload responses
+            latency_tolerance (float): Latency ratio to the baseline above which the limit stops growing
+            error_tolerance (float): Error rate over the last window above which the limit stops growing
+        """
+        assert 0 < backoff < 1, "`backoff` must be between 0 and 1"
+        assert 1 <= min_limit <= max_limit, "`min_limit` must be between 1 and `max_limit`"
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.error_tolerance = error_tolerance
+
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.stats = {"successes": 0, "errors": 0, "overloads": 0, "decreases": 0}
+        self._baseline_latency = None
+        self._smoothed_latency = None
+        self._last_decrease = 0.0
+        self._outcomes = deque(maxlen=max_limit)
+        self._waiters = deque()
+        self._condition = threading.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot under the current limit."""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Checked and taken under the lock, as synchronous callers share the count from other threads
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot handed to this waiter goes to the next one
+                    with self._condition:
+                        self._wake()
+                raise
+
+    def acquire_blocking(self):
+        """Blocking counterpart of `acquire`, for requests sent from synchronous code."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+            self._wake()
+
+    def record_success(self, latency):
+        self.stats["successes"] += 1
+        self._outcomes.append(False)
+        self._smoothed_latency = latency if self._smoothed_latency is None else 0.9 * self._smoothed_latency + 0.1 * latency
+        if self._baseline_latency is None or self._smoothed_latency < self._baseline_latency:
+            self._baseline_latency = self._smoothed_latency
+
+        saturated = self.in_flight >= int(self.limit)
+        healthy = self._smoothed_latency <= self.latency_tolerance * self._baseline_latency
+        if saturated and healthy and self._error_rate() <= self.error_tolerance:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def record_error(self, overload=False):
+        self.stats["errors"] += 1
+        self._outcomes.append(True)
+        if not overload:
+            return
+        self.stats["overloads"] += 1
+        # Requests sent before the previous decrease may still be failing, react once per round trip
+        now = time.monotonic()
+        if now - self._last_decrease >= (self._smoothed_latency or 0.0):
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._last_decrease = now
+            self.stats["decreases"] += 1
+
+    def _error_rate(self):
+        window = list(self._outcomes)[-max(int(self.limit), 1):]
+        return sum(window) / len(window)
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                loop = waiter.get_loop()
+                try:
+                    running_loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    running_loop = None
+                if running_loop is loop:
+                    waiter.set_result(None)
+                else:
+                    # Released from a synchronous caller's thread
+                    loop.call_soon_threadsafe(_resolve_waiter, waiter)
+                free -= 1
+
+
+def _resolve_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,205 @@
+import time
+import random
+import asyncio
+from collections import deque
+
+# Errors that will not go away by sending the same request again
+NON_RETRYABLE_EXCEPTIONS = {
+    "BadRequestError": 1,
+    "AuthenticationError": 1,
+    "PermissionDeniedError": 1,
+    "NotFoundError": 1,
+    "ContextWindowExceededError": 1,
+    "ContentPolicyViolationError": 1,
+    "UnsupportedParamsError": 1,
+}
+
+# Seconds between checks for a hedge delay while too few latencies have been observed
+HEDGE_RECHECK_INTERVAL = 0.5
+
+
+class RetryPolicy:
+    """
+    Retries, backoff, deadline and hedging of the requests sent by a client.
+
+    Failed attempts are retried with exponential backoff and full jitter, up to a number of
+    attempts that can be set per exception class. The whole call, retries included, is bounded
+    by `deadline`. With `hedge=True`, a duplicate request is sent when an attempt takes longer
+    than the `hedge_quantile` of recent latencies, and whichever answer arrives first is used.
+
+    Examples:
+        policy = RetryPolicy(max_attempts=5, deadline=120, hedge=True)
+        client = UniversalClient(model="gpt-4o", retry_policy=policy)
+    """
+
+    def __init__(self, max_attempts=3, max_attempts_by_exception=None, base_delay=0.5, max_delay=30.0, jitter=True, deadline=None, hedge=False, hedge_quantile=0.95, hedge_min_samples=20, max_hedges=1):
+        """
+        Args:
+            max_attempts (int): Attempts per call, including the first one
+            max_attempts_by_exception (dict): Attempts for specific exception classes, keyed by class or
+                class name (e.g. {"RateLimitError": 8}). The exception and the errors it wraps are
+                matched against the keys, the first match wins. Defaults to a single attempt for
+                errors such as bad requests or authentication failures.
+            base_delay (float): Backoff before the first retry, in seconds, doubled on every retry
+            max_delay (float): Upper bound of the backoff, in seconds
+            jitter (bool): Draw each backoff uniformly between 0 and its nominal value
+            deadline (float): Time budget of a call in seconds, retries included. None for no limit.
+            hedge (bool): Send a duplicate request when an attempt is slower than usual
+            hedge_quantile (float): Latency quantile after which the duplicate is sent
+            hedge_min_samples (int): Successful attempts observed before hedging starts
+            max_hedges (int): Maximum duplicates per attempt
+        """
+        assert max_attempts >= 1, "`max_attempts` must be at least 1"
+        assert 0 < hedge_quantile < 1, "`hedge_quantile` must be between 0 and 1"
+        self.max_attempts = max_attempts
+        self.max_attempts_by_exception = {**NON_RETRYABLE_EXCEPTIONS, **(max_attempts_by_exception or {})}
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_hedges = max_hedges
+
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+        self._latencies = deque(maxlen=1000)
+        self._hedge_delay = None
+
+    def get_max_attempts(self, error):
+        """Return the number of attempts allowed for an exception."""
+        while error is not None:
+            for exception_type in type(error).__mro__:
+                for key in [exception_type, exception_type.__name__]:
+                    if key in self.max_attempts_by_exception:
+                        return self.max_attempts_by_exception[key]
+            error = error.__cause__
+        return self.max_attempts
+
+    def get_backoff(self, retry, error=None):
+        """Return the wait before retry number `retry` (starting at 1)."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (retry - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return max(delay, self._get_retry_after(error))
+
+    def get_hedge_delay(self):
+        """Return the time after which an attempt is hedged, or None while there are too few samples."""
+        if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+            return None
+        if self._hedge_delay is None:
+            latencies = sorted(self._latencies)
+            self._hedge_delay = latencies[min(int(len(latencies) * self.hedge_quantile), len(latencies) - 1)]
+        return self._hedge_delay
+
+    def record_latency(self, latency):
+        self._latencies.append(latency)
+        # Recompute the quantile lazily, every few samples
+        if len(self._latencies) % 10 == 0:
+            self._hedge_delay = None
+
+    def run(self, attempt):
+        """
+        Call `attempt(timeout)` until it succeeds, retrying according to the policy.
+
+        `timeout` is the time left before the deadline (None without a deadline); blocking calls
+        cannot be interrupted, so it should be forwarded to the request. Hedging only applies to `arun`.
+        """
+        self.stats["calls"] += 1
+        end = time.monotonic() + self.deadline if self.deadline else None
+        retry = 0
+        while True:
+            start = time.monotonic()
+            try:
+                result = attempt(end - start if end else None)
+                self.record_latency(time.monotonic() - start)
+                return result
+            except Exception as e:
+                retry += 1
+                delay = self._next_delay(retry, e, end)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def arun(self, attempt):
+        """
+        Await `attempt()` until it succeeds, retrying and hedging according to the policy.
+
+        `attempt` is a coroutine function, called once per attempt and once per duplicate request.
+        """
+        self.stats["calls"] += 1
+        end = time.monotonic() + self.deadline if self.deadline else None
+        retry = 0
+        while True:
+            try:
+                timeout = max(end - time.monotonic(), 0) if end else None
+                return await asyncio.wait_for(self._ahedged(attempt), timeout)
+            except Exception as e:
+                # `asyncio.TimeoutError` is the builtin `TimeoutError` on Python 3.11+, which an attempt may raise itself
+                if isinstance(e, asyncio.TimeoutError) and end is not None and time.monotonic() >= end:
+                    self.stats["deadline_exceeded"] += 1
+                    raise TimeoutError(f"Request did not complete within the {self.deadline}s deadline") from e
+                retry += 1
+                delay = self._next_delay(retry, e, end)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    async def _ahedged(self, attempt):
+        start = time.monotonic()
+        primary = asyncio.ensure_future(attempt())
+        tasks = [primary]
+        sent = 1
+        try:
+            while True:
+                hedge_delay = self.get_hedge_delay() if sent <= self.max_hedges else None
+                if hedge_delay is not None:
+                    timeout = max(start + hedge_delay * sent - time.monotonic(), 0)
+                elif self.hedge and sent <= self.max_hedges:
+                    # Not enough latency samples yet, check again once more attempts have finished
+                    timeout = HEDGE_RECHECK_INTERVAL
+                else:
+                    timeout = None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done and hedge_delay is None:
+                    continue
+                if not done:
+                    # The attempt is slower than usual: race a duplicate against it
+                    self.stats["hedges"] += 1
+                    tasks.append(asyncio.ensure_future(attempt()))
+                    sent += 1
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        self.record_latency(time.monotonic() - start)
+                        if task is not primary:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                tasks = [task for task in tasks if task not in done]
+                if not tasks:
+                    # Every request of the attempt failed
+                    raise next(iter(done)).exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _next_delay(self, retry, error, end):
+        """Return the backoff before the next retry, or None if the call should fail."""
+        if retry >= self.get_max_attempts(error):
+            return None
+        delay = self.get_backoff(retry, error)
+        if end is not None and time.monotonic() + delay >= end:
+            self.stats["deadline_exceeded"] += 1
+            return None
+        self.stats["retries"] += 1
+        return delay
+
+    @staticmethod
+    def _get_retry_after(error):
+        # Honour the Retry-After header of rate-limit responses when the provider sends one
+        while error is not None:
+            try:
+                return float(error.response.headers["retry-after"])
+            except Exception:
+                error = error.__cause__
+        return 0.0
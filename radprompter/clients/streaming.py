@@ -0,0 +1,123 @@
+import inspect
+
+
+class StreamTerminator:
+    """
+    Detect, from the text streamed so far, that an answer is complete.
+
+    An answer is complete once one of its stop strings appears or, for structured answers, once
+    the first JSON object closes (braces inside strings are ignored). The streamed text is then
+    cut where the complete answer ends, as the provider would have done with its own stop logic.
+
+    Examples:
+        terminator = StreamTerminator(stop=["</answer>"], json_mode=False)
+        for text in chunks:
+            if terminator.feed(text):
+                break
+        answer = terminator.text
+    """
+
+    def __init__(self, stop=None, json_mode=False):
+        """
+        Args:
+            stop (str or list): Stop strings; the answer ends right before the first of them
+            json_mode (bool): End the answer after the first complete JSON object
+        """
+        if isinstance(stop, str):
+            stop = [stop]
+        self.stop = [s for s in (stop or []) if s]
+        self.json_mode = json_mode
+        self.complete = False
+        self._parts = []
+        self._length = 0
+        self._end = None
+        # JSON scanner state
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Tail of the text kept to find stop strings spanning two chunks
+        self._tail = ""
+
+    @property
+    def text(self):
+        text = "".join(self._parts)
+        return text[:self._end] if self._end is not None else text
+
+    def feed(self, text):
+        """Add a streamed chunk of text; returns True once the answer is complete."""
+        if self.complete or not text:
+            return self.complete
+        offset = self._length
+        self._parts.append(text)
+        self._length += len(text)
+
+        end = None
+        if self.stop:
+            window = self._tail + text
+            positions = [window.find(stop) for stop in self.stop]
+            positions = [position for position in positions if position != -1]
+            if positions:
+                end = offset - len(self._tail) + min(positions)
+            longest = max(len(stop) for stop in self.stop)
+            self._tail = window[-(longest - 1):] if longest > 1 else ""
+
+        if self.json_mode:
+            for position, char in enumerate(text if end is None else text[:max(end - offset, 0)]):
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif char == "\\":
+                        self._escaped = True
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"' and self._depth > 0:
+                    self._in_string = True
+                elif char == "{":
+                    self._depth += 1
+                elif char == "}" and self._depth > 0:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        end = offset + position + 1
+                        break
+
+        if end is not None:
+            self._end = end
+            self.complete = True
+        return self.complete
+
+
+def get_chunk_text(chunk):
+    """Return the text of a streamed chat completion chunk ("" for role or usage chunks)."""
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return ""
+    delta = getattr(choices[0], "delta", None)
+    return getattr(delta, "content", None) or ""
+
+
+def close_stream(stream):
+    """Close a LiteLLM stream whose answer is complete, so the provider stops generating."""
+    for target in [stream, getattr(stream, "completion_stream", None), getattr(stream, "response", None)]:
+        close = getattr(target, "close", None)
+        if close is not None and not inspect.iscoroutinefunction(close):
+            try:
+                close()
+            except Exception:
+                pass
+            return
+
+
+async def aclose_stream(stream):
+    """Asynchronous counterpart of `close_stream`."""
+    for target in [stream, getattr(stream, "completion_stream", None), getattr(stream, "response", None)]:
+        for name in ["aclose", "close"]:
+            close = getattr(target, name, None)
+            if close is None:
+                continue
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
+            return
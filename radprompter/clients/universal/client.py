@@ -1,8 +1,16 @@
 from ..client import Client
+from ..rate_limit import RateLimiter, AdaptiveConcurrency, is_overload_error
+from ..retry import RetryPolicy
+from ..streaming import StreamTerminator, get_chunk_text, close_stream, aclose_stream
+import time
+import asyncio
 import warnings
 import litellm # type: ignore
 litellm.set_verbose = False
 
+# Providers that only cache prompts explicitly marked with `cache_control`
+CACHE_CONTROL_PROVIDERS = ["anthropic", "gemini", "vertex_ai", "bedrock"]
+
 class UniversalClient(Client):
     """
     Universal client using LiteLLM that supports multiple LLM providers.
@@ -40,6 +48,17 @@ class UniversalClient(Client):
             model="huggingface/meta-llama/Meta-Llama-3-8B-Instruct",
             api_base="https://your-endpoint.com"
         )
+        
+        # Stay under the account quota and let the client find the highest sustainable concurrency
+        client = UniversalClient(
+            model="gpt-4o",
+            requests_per_minute=5000,
+            tokens_per_minute=800000,
+            adaptive_concurrency=True
+        )
+        
+        # Stream answers and close the stream as soon as the JSON object or stop tag is complete
+        client = UniversalClient(model="gpt-4o", stream=True)
     """
     
     def __init__(self, model, **kwargs):
@@ -58,6 +77,16 @@ class UniversalClient(Client):
                 - seed (int): Random seed for reproducibility
                 - frequency_penalty (float): Frequency penalty (default: 0.0)
                 - presence_penalty (float): Presence penalty (default: 0.0)
+                - requests_per_minute (int): Client-side limit on requests per minute
+                - tokens_per_minute (int): Client-side limit on prompt + completion tokens per minute
+                - adaptive_concurrency (bool): Adapt the number of in-flight requests to the
+                  provider's latency and rate-limit responses (default: False)
+                - max_concurrency (int): Upper bound of the adaptive concurrency limit (default: 256)
+                - retry_policy (RetryPolicy): Retries, backoff, deadline and hedging of failed or slow
+                  requests (default: None, every request is sent once)
+                - stream (bool): Stream completions, end them client-side once the answer is complete
+                  (JSON object closed or stop sequence generated) and record the time to first token
+                  and to the complete answer of every call (default: False)
         """
         
         # Extract parameters
@@ -79,6 +108,21 @@ class UniversalClient(Client):
         self.seed = kwargs.pop("seed", None)
         self.frequency_penalty = kwargs.pop("frequency_penalty", 0.0)
         self.presence_penalty = kwargs.pop("presence_penalty", 0.0)
+        
+        self.requests_per_minute = kwargs.pop("requests_per_minute", None)
+        self.tokens_per_minute = kwargs.pop("tokens_per_minute", None)
+        self.rate_limiter = None
+        if self.requests_per_minute or self.tokens_per_minute:
+            self.rate_limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+        
+        adaptive_concurrency = kwargs.pop("adaptive_concurrency", False)
+        max_concurrency = kwargs.pop("max_concurrency", 256)
+        self.concurrency_controller = AdaptiveConcurrency(initial=min(8, max_concurrency), max_limit=max_concurrency) if adaptive_concurrency else None
+        
+        self.retry_policy = kwargs.pop("retry_policy", None)
+        assert self.retry_policy is None or isinstance(self.retry_policy, RetryPolicy), "`retry_policy` must be a `RetryPolicy`"
+        
+        self.streaming = kwargs.pop("stream", False)
                 
         # Ensure api_base does not end with /chat/completions or trailing /
         if self.api_base:
@@ -107,20 +151,46 @@ class UniversalClient(Client):
 
         super().__init__(model)
 
-    def chat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+    def build_user_content(self, prefix, tail):
         """
-        Complete a chat conversation using LiteLLM.
-        
-        Args:
-            messages (list): List of message dictionaries with 'role' and 'content'
-            stop (str or list): Stop sequence(s) to end generation
-            max_tokens (int): Maximum tokens to generate (overrides instance default)
-            response_format (dict): Response format specification (e.g., JSON schema)
-            
-        Returns:
-            str: The generated response text
+        Build a user message whose shared prefix carries a `cache_control` marker for providers
+        with explicit prompt caching. Other providers (OpenAI, vLLM, ...) cache identical
+        prefixes automatically and receive plain text.
+        """
+        if self.provider not in CACHE_CONTROL_PROVIDERS or not prefix or not tail:
+            return prefix + tail
+        return [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": tail},
+        ]
+
+    def count_prompt_tokens(self, messages):
+        """Estimate the prompt tokens of a request, used by the tokens-per-minute limit."""
+        try:
+            return litellm.token_counter(model=self.model, messages=messages)
+        except Exception:
+            return sum(len(str(message.get("content", ""))) for message in messages) // 4
+
+    def _acquire_rate_limit(self, messages):
+        if self.rate_limiter is None:
+            return 0.0
+        return self.rate_limiter.reserve(self.count_prompt_tokens(messages) if self.tokens_per_minute else 0)
+
+    def _record_response(self, response):
+        usage = getattr(response, "usage", None)
+        try:
+            cost = litellm.completion_cost(completion_response=response)
+        except Exception:
+            # Models missing from LiteLLM's pricing tables (local deployments, ...)
+            cost = None
+        self.record_usage(usage, cost=cost)
+        if self.rate_limiter is not None:
+            self.rate_limiter.charge(getattr(usage, "completion_tokens", None) or 0)
+
+    def _build_completion_args(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+        """
+        Assemble the keyword arguments shared by `chat_complete` and `achat_complete`.
         """
-        # Prepare completion arguments
         completion_args = {
             "model": self.model,
             "messages": messages,
@@ -156,12 +226,35 @@ class UniversalClient(Client):
         if response_format:
             completion_args["response_format"] = response_format
         
+        if self.streaming:
+            completion_args["stream"] = True
+            completion_args["stream_options"] = {"include_usage": True}
+        
         # Add any extra kwargs that might be needed for specific providers
         completion_args.update(self.extra_kwargs)
         
+        return completion_args
+
+    def chat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+        """
+        Complete a chat conversation using LiteLLM.
+        
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            stop (str or list): Stop sequence(s) to end generation
+            max_tokens (int): Maximum tokens to generate (overrides instance default)
+            response_format (dict): Response format specification (e.g., JSON schema)
+            
+        Returns:
+            str: The generated response text
+        """
+        completion_args = self._build_completion_args(messages, stop, max_tokens, response_format, **kwargs)
+        
         try:
-            # Make the completion request
-            response = litellm.completion(**completion_args)
+            if self.retry_policy is None:
+                response = self._complete_once(messages, completion_args)
+            else:
+                response = self.retry_policy.run(lambda timeout: self._complete_once(messages, completion_args, timeout))
             
             # Extract the response text
             return response.choices[0].message.content
@@ -169,3 +262,173 @@ class UniversalClient(Client):
         except Exception as e:
             # Re-raise with more context
             raise RuntimeError(f"LiteLLM completion failed for model {self.model}: {str(e)}") from e
+
+    def _complete_once(self, messages, completion_args, timeout=None):
+        if timeout is not None:
+            completion_args = {**completion_args, "timeout": timeout}
+        
+        def request():
+            # Make the completion request
+            start = time.monotonic()
+            response = litellm.completion(**completion_args)
+            if self.streaming:
+                response = self._consume_stream(response, completion_args, start)
+            return response
+        
+        response = self._send_once(messages, request)
+        self._record_response(response)
+        return response
+
+    def _send_once(self, messages, request):
+        """
+        Send one request to the provider under the adaptive concurrency limit and the rate limit.
+        
+        Args:
+            messages (list): Messages of the request, whose tokens are reserved from the rate limit
+            request (callable): Sends the request and returns its response
+        """
+        controller = self.concurrency_controller
+        if controller is not None:
+            controller.acquire_blocking()
+        
+        try:
+            time.sleep(self._acquire_rate_limit(messages))
+            start = time.monotonic()
+            response = request()
+            if controller is not None:
+                controller.record_success(time.monotonic() - start)
+        
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        
+        finally:
+            if controller is not None:
+                controller.release()
+        
+        return response
+
+    def _record_failure(self, error):
+        controller = self.concurrency_controller
+        if is_overload_error(error):
+            if self.rate_limiter is not None:
+                self.rate_limiter.drain()
+            if controller is not None:
+                controller.record_error(overload=True)
+        elif controller is not None:
+            controller.record_error()
+
+    async def achat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+        """
+        Complete a chat conversation using LiteLLM's native async API.
+        
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            stop (str or list): Stop sequence(s) to end generation
+            max_tokens (int): Maximum tokens to generate (overrides instance default)
+            response_format (dict): Response format specification (e.g., JSON schema)
+            
+        Returns:
+            str: The generated response text
+        """
+        completion_args = self._build_completion_args(messages, stop, max_tokens, response_format, **kwargs)
+        
+        try:
+            if self.retry_policy is None:
+                response = await self._acomplete_once(messages, completion_args)
+            else:
+                response = await self.retry_policy.arun(lambda: self._acomplete_once(messages, completion_args))
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            raise RuntimeError(f"LiteLLM completion failed for model {self.model}: {str(e)}") from e
+
+    async def _acomplete_once(self, messages, completion_args):
+        async def request():
+            start = time.monotonic()
+            response = await litellm.acompletion(**completion_args)
+            if self.streaming:
+                response = await self._aconsume_stream(response, completion_args, start)
+            return response
+        
+        response = await self._asend_once(messages, request)
+        self._record_response(response)
+        return response
+
+    async def _asend_once(self, messages, request):
+        """Asynchronous counterpart of `_send_once`; `request` is a coroutine function."""
+        controller = self.concurrency_controller
+        if controller is not None:
+            await controller.acquire()
+        
+        try:
+            await asyncio.sleep(self._acquire_rate_limit(messages))
+            start = time.monotonic()
+            response = await request()
+            if controller is not None:
+                controller.record_success(time.monotonic() - start)
+        
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        
+        finally:
+            if controller is not None:
+                controller.release()
+        
+        return response
+
+    def _consume_stream(self, stream, completion_args, start):
+        """
+        Read a streamed completion until the answer is complete, then close the stream.
+        
+        Returns:
+            The completion assembled from the chunks read, holding the answer cut where it ends
+        """
+        terminator = self._get_stream_terminator(completion_args)
+        chunks = []
+        first_token = None
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                text = get_chunk_text(chunk)
+                if text and first_token is None:
+                    first_token = time.monotonic()
+                if terminator.feed(text):
+                    break
+        finally:
+            if terminator.complete:
+                close_stream(stream)
+        return self._build_streamed_response(chunks, completion_args, terminator, start, first_token)
+
+    async def _aconsume_stream(self, stream, completion_args, start):
+        """Asynchronous counterpart of `_consume_stream`."""
+        terminator = self._get_stream_terminator(completion_args)
+        chunks = []
+        first_token = None
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                text = get_chunk_text(chunk)
+                if text and first_token is None:
+                    first_token = time.monotonic()
+                if terminator.feed(text):
+                    break
+        finally:
+            if terminator.complete:
+                await aclose_stream(stream)
+        return self._build_streamed_response(chunks, completion_args, terminator, start, first_token)
+
+    @staticmethod
+    def _get_stream_terminator(completion_args):
+        return StreamTerminator(completion_args.get("stop"), json_mode=bool(completion_args.get("response_format")))
+
+    def _build_streamed_response(self, chunks, completion_args, terminator, start, first_token):
+        end = time.monotonic()
+        response = litellm.stream_chunk_builder(chunks, messages=completion_args["messages"]) if chunks else None
+        if response is None:
+            raise RuntimeError("The streamed completion returned no chunks.")
+        # Streams closed early do not report usage; LiteLLM then counts the tokens of the chunks read
+        response.choices[0].message.content = terminator.text
+        self.record_timing(first_token - start if first_token is not None else None, end - start, early_stop=terminator.complete)
+        return response
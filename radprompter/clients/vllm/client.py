@@ -1,4 +1,7 @@
 from ..universal.client import UniversalClient
+import asyncio
+from types import SimpleNamespace
+import httpx # type: ignore
 
 class vLLMClient(UniversalClient):
     """
@@ -27,8 +30,15 @@ class vLLMClient(UniversalClient):
             temperature=0.0,
             seed=42
         )
+    
+    `score_options` scores candidate answers with the server's `/tokenize` endpoint and an
+    `echo` request to `/v1/completions`, without generating. Scoring requests share one HTTP
+    connection pool per client and go through the same rate limit, adaptive concurrency limit
+    and retry policy as completions.
     """
     
+    supports_scoring = True
+    
     def __init__(self, model, **kwargs):
         """
         Initialize the vLLM client.
@@ -36,8 +46,10 @@ class vLLMClient(UniversalClient):
         Args:
             model (str): Model name (will be prefixed with 'hosted_vllm/')
             api_base (str): Base URL of the vLLM server (required)
+            scoring_timeout (float): Timeout in seconds of each scoring HTTP request (default: 120)
             **kwargs: Additional parameters passed to UniversalClient
         """
+        self.scoring_timeout = kwargs.pop("scoring_timeout", 120.0)
         # Ensure api_base is provided for vLLM
         if not kwargs.get("api_base") and not kwargs.get("base_url"):
             raise ValueError("api_base is required for vLLM client. Please provide the vLLM server URL.")
@@ -51,8 +63,28 @@ class vLLMClient(UniversalClient):
             model = f"hosted_vllm/{model}"
         
         super().__init__(model, **kwargs)
+        # Token ids of the options scored so far; the same options are scored for every item
+        self._option_tokens = {}
+        # HTTP clients of the scoring requests, created on first use (the async one per event loop)
+        self._http = None
+        self._async_http = None
+        self._async_http_loop = None
+    
+    def _get_vllm_params(self, messages):
+        """
+        Automatically determine vLLM-specific parameters based on message structure.
+        """
+        vllm_params = {}
+        
+        # If the last message is an assistant message, we need to continue it
+        # This happens when there's a response template/prefix
+        if messages and messages[-1]['role'] == "assistant":
+            vllm_params['continue_final_message'] = True
+            vllm_params['add_generation_prompt'] = False
+        
+        return vllm_params
     
-    def chat_complete(self, messages, stop=None, max_tokens=None, response_format=None):
+    def chat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
         """
         Complete a chat conversation using vLLM with automatic handling of vLLM-specific parameters.
         
@@ -66,20 +98,147 @@ class vLLMClient(UniversalClient):
         Returns:
             str: The generated response text
         """
-        # Automatically determine vLLM-specific parameters based on message structure
-        vllm_params = {}
-        
-        # If the last message is an assistant message, we need to continue it
-        # This happens when there's a response template/prefix
-        if messages and messages[-1]['role'] == "assistant":
-            vllm_params['continue_final_message'] = True
-            vllm_params['add_generation_prompt'] = False
-        
         # Pass all parameters to the parent method
         return super().chat_complete(
             messages=messages, 
             stop=stop, 
             max_tokens=max_tokens, 
             response_format=response_format, 
-            **vllm_params,
-        )
\ No newline at end of file
+            **self._get_vllm_params(messages),
+            **kwargs,
+        )
+    
+    async def achat_complete(self, messages, stop=None, max_tokens=None, response_format=None, **kwargs):
+        """
+        Asynchronous counterpart of `chat_complete`.
+        """
+        return await super().achat_complete(
+            messages=messages, 
+            stop=stop, 
+            max_tokens=max_tokens, 
+            response_format=response_format, 
+            **self._get_vllm_params(messages),
+            **kwargs,
+        )
+
+    def score_options(self, messages, options):
+        """
+        Score candidate continuations from the prompt log-probabilities returned by the server.
+        
+        The conversation is rendered and tokenized by the server's chat template, each option is
+        appended as tokens, and a single `/v1/completions` request with `echo=True` returns the
+        log-probability of every prompt token.
+        
+        Args:
+            messages (list): The conversation; a final assistant message is continued
+            options (list): Candidate continuations (strings)
+            
+        Returns:
+            list: The log-probability of each option's tokens, summed and divided by their number
+        """
+        if self.retry_policy is None:
+            return self._send_once(messages, lambda: self._score_once(messages, options))
+        return self.retry_policy.run(lambda timeout: self._send_once(messages, lambda: self._score_once(messages, options, timeout)))
+    
+    async def ascore_options(self, messages, options):
+        """
+        Asynchronous counterpart of `score_options`.
+        """
+        if self.retry_policy is None:
+            return await self._asend_once(messages, lambda: self._ascore_once(messages, options))
+        return await self.retry_policy.arun(lambda: self._asend_once(messages, lambda: self._ascore_once(messages, options)))
+    
+    def _score_once(self, messages, options, timeout=None):
+        http = self._get_http()
+        timeout = min(timeout, self.scoring_timeout) if timeout is not None else self.scoring_timeout
+        prompt_ids = self._post(http, "/tokenize", self._get_tokenize_request(messages), timeout)["tokens"]
+        option_ids = [self._tokenize_option(http, option, timeout) for option in options]
+        response = self._post(http, "/v1/completions", self._get_scoring_request(prompt_ids, option_ids), timeout)
+        return self._get_option_scores(response, prompt_ids, option_ids)
+    
+    async def _ascore_once(self, messages, options):
+        http = self._get_async_http()
+        prompt_ids = (await self._apost(http, "/tokenize", self._get_tokenize_request(messages)))["tokens"]
+        option_ids = await asyncio.gather(*[self._atokenize_option(http, option) for option in options])
+        response = await self._apost(http, "/v1/completions", self._get_scoring_request(prompt_ids, option_ids))
+        return self._get_option_scores(response, prompt_ids, option_ids)
+    
+    def _get_http(self):
+        if self._http is None:
+            self._http = httpx.Client(headers=self._get_headers(), timeout=self.scoring_timeout)
+        return self._http
+    
+    def _get_async_http(self):
+        # An async HTTP client is bound to the event loop it was created in
+        loop = asyncio.get_running_loop()
+        if self._async_http is None or self._async_http_loop is not loop:
+            self._async_http = httpx.AsyncClient(headers=self._get_headers(), timeout=self.scoring_timeout)
+            self._async_http_loop = loop
+        return self._async_http
+    
+    def _get_headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+    
+    def _get_server_url(self, path):
+        # The tokenizer endpoints are served at the root, next to `/v1`
+        root = self.api_base[:-len("/v1")] if self.api_base.endswith("/v1") else self.api_base
+        return root + path
+    
+    def _get_served_model(self):
+        return self.model[len("hosted_vllm/"):] if self.model.startswith("hosted_vllm/") else self.model
+    
+    def _get_tokenize_request(self, messages):
+        return {
+            "model": self._get_served_model(),
+            "messages": messages,
+            "add_generation_prompt": messages[-1]['role'] != "assistant",
+            "continue_final_message": messages[-1]['role'] == "assistant",
+            "add_special_tokens": False,
+        }
+    
+    def _get_scoring_request(self, prompt_ids, option_ids):
+        return {
+            "model": self._get_served_model(),
+            "prompt": [prompt_ids + list(ids) for ids in option_ids],
+            "max_tokens": 1,
+            "temperature": 0.0,
+            "echo": True,
+            "logprobs": 0,
+        }
+    
+    def _tokenize_option(self, http, option, timeout=None):
+        option_ids = self._option_tokens.get(option)
+        if option_ids is None:
+            option_ids = self._option_tokens[option] = self._post(http, "/tokenize", self._get_option_request(option), timeout)["tokens"]
+        return option_ids
+    
+    async def _atokenize_option(self, http, option):
+        option_ids = self._option_tokens.get(option)
+        if option_ids is None:
+            option_ids = self._option_tokens[option] = (await self._apost(http, "/tokenize", self._get_option_request(option)))["tokens"]
+        return option_ids
+    
+    def _get_option_request(self, option):
+        return {"model": self._get_served_model(), "prompt": option, "add_special_tokens": False}
+    
+    def _post(self, http, path, payload, timeout=None):
+        response = http.post(self._get_server_url(path), json=payload, timeout=timeout or self.scoring_timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    async def _apost(self, http, path, payload):
+        response = await http.post(self._get_server_url(path), json=payload)
+        response.raise_for_status()
+        return response.json()
+    
+    def _get_option_scores(self, response, prompt_ids, option_ids):
+        usage = response.get("usage")
+        if usage:
+            self.record_usage(SimpleNamespace(**usage))
+        scores = [None] * len(option_ids)
+        for choice in response["choices"]:
+            ids = option_ids[choice["index"]]
+            token_logprobs = choice["logprobs"]["token_logprobs"]
+            # Length-normalised, so that options with more tokens are not penalised
+            scores[choice["index"]] = sum(token_logprobs[len(prompt_ids):len(prompt_ids) + len(ids)]) / max(len(ids), 1)
+        return scores
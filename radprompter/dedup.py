@@ -0,0 +1,178 @@
+import re
+import zlib
+import hashlib
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(value):
+    """Normalise a field value for duplicate detection: Unicode NFKC, case-folded, whitespace collapsed."""
+    text = value if isinstance(value, str) else str(value)
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+
+def get_lsh_params(threshold, num_perm):
+    """
+    Choose the number of LSH bands and rows per band for a Jaccard similarity threshold.
+
+    Minimises the (equally weighted) probabilities of missing pairs above the threshold and of
+    comparing pairs below it, as in Leskovec et al., "Mining of Massive Datasets", chapter 3.
+
+    Returns:
+        tuple: (bands, rows)
+    """
+    steps = np.linspace(0.0, 1.0, 201)
+    best, best_error = None, None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            probability = 1.0 - (1.0 - steps ** rows) ** bands
+            false_positives = np.where(steps < threshold, probability, 0.0).mean()
+            false_negatives = np.where(steps >= threshold, 1.0 - probability, 0.0).mean()
+            error = false_positives + false_negatives
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+class Deduplicator:
+    """
+    Assign every item to the first earlier item it duplicates, so that it only has to be processed once.
+
+    Items are compared on the normalised values of their `fields` (the item placeholders of the
+    prompt): identical values are exact duplicates. With a `near_duplicate_threshold`, items
+    whose character shingles have an estimated Jaccard similarity of at least the threshold with
+    an earlier unique item are near duplicates of it. Similarities are estimated with MinHash
+    signatures and candidates are found with a banded locality-sensitive hashing index, so each
+    item is only compared with the few unique items sharing a band with it.
+
+    With `max_items`, only the most recently matched unique items are kept in the index (with
+    their hashes, signatures and buckets), so memory stays constant over a corpus of any size; a
+    duplicate of an evicted item is registered as a new unique item.
+
+    Examples:
+        deduplicator = Deduplicator(["report"], near_duplicate_threshold=0.9)
+        deduplicator.register({"report": "No acute cardiopulmonary abnormality."}, 0)   # 0
+        deduplicator.register({"report": "no acute cardiopulmonary  abnormality."}, 1)  # 0 (exact)
+        deduplicator.register({"report": "No acute cardiopulmonary abnormality"}, 2)    # 0 (near)
+    """
+
+    def __init__(self, fields=None, near_duplicate_threshold=None, num_perm=128, shingle_size=5, seed=1, max_items=None):
+        """
+        Args:
+            fields (list): Item fields compared (default: None, every field of the item)
+            near_duplicate_threshold (float): Jaccard similarity from which items are near duplicates
+                (default: None, only exact duplicates are detected)
+            num_perm (int): Number of MinHash permutations
+            shingle_size (int): Length of the character shingles compared
+            seed (int): Seed of the MinHash permutations
+            max_items (int): Number of unique items kept in the index (default: None, every unique item)
+        """
+        if near_duplicate_threshold is not None and not 0.0 < near_duplicate_threshold <= 1.0:
+            raise ValueError(f"`near_duplicate_threshold` must be in (0, 1], got {near_duplicate_threshold}.")
+        self.fields = list(fields) if fields is not None else None
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_items = max_items
+        self.stats = {"items": 0, "unique": 0, "exact_duplicates": 0, "near_duplicates": 0, "evicted": 0}
+        self._keys = {}
+        # Hashes of the texts resolving to every unique item, least recently matched first
+        self._members = OrderedDict()
+
+        if near_duplicate_threshold is not None:
+            generator = np.random.RandomState(seed)
+            self._a = generator.randint(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+            self._b = generator.randint(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+            self.bands, self.rows = get_lsh_params(near_duplicate_threshold, num_perm)
+            self._buckets = [{} for _ in range(self.bands)]
+            self._signatures = {}
+
+    def get_text(self, item):
+        """Return the normalised values of the compared fields of `item`, joined in a single string."""
+        fields = self.fields if self.fields is not None else sorted(item, key=str)
+        return "\x1f".join(f"{field}\x1e{normalize_text(item[field])}" for field in fields if field in item)
+
+    def get_signature(self, text):
+        """MinHash signature of the character shingles of `text`."""
+        size = self.shingle_size
+        shingles = {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        # Universal hashing (a * x + b) mod p of every shingle hash for every permutation
+        permuted = (self._a * hashes + self._b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def register(self, item, index):
+        """
+        Look up `item` among the items registered so far.
+
+        Returns:
+            int: Index of the item `item` duplicates, or `index` if it is the first of its kind
+        """
+        self.stats["items"] += 1
+        text = self.get_text(item)
+        key = hashlib.md5(text.encode()).digest()
+        representative = self._keys.get(key)
+        if representative is not None:
+            self.stats["exact_duplicates"] += 1
+            self._members.move_to_end(representative)
+            return representative
+
+        if self.near_duplicate_threshold is not None:
+            signature = self.get_signature(text)
+            bands = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+            candidates = {candidate for bucket, band in zip(self._buckets, bands) for candidate in bucket.get(band, ())}
+            best, best_similarity = None, self.near_duplicate_threshold
+            for candidate in sorted(candidates):
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= best_similarity and (best is None or similarity > best_similarity):
+                    best, best_similarity = candidate, similarity
+            if best is not None:
+                self.stats["near_duplicates"] += 1
+                # Later exact copies of this text resolve without another lookup
+                self._keys[key] = best
+                self._members[best].append(key)
+                self._members.move_to_end(best)
+                return best
+            # Only unique items are indexed, so that near duplicates do not drift away in chains
+            for bucket, band in zip(self._buckets, bands):
+                bucket.setdefault(band, []).append(index)
+            self._signatures[index] = signature
+
+        self._keys[key] = index
+        self._members[index] = [key]
+        self.stats["unique"] += 1
+        if self.max_items is not None and len(self._members) > self.max_items:
+            self._evict()
+        return index
+
+    def _evict(self):
+        representative, keys = self._members.popitem(last=False)
+        for key in keys:
+            del self._keys[key]
+        if self.near_duplicate_threshold is not None:
+            signature = self._signatures.pop(representative)
+            for number, bucket in enumerate(self._buckets):
+                band = signature[number * self.rows:(number + 1) * self.rows].tobytes()
+                bucket[band].remove(representative)
+                if not bucket[band]:
+                    del bucket[band]
+        self.stats["evicted"] += 1
+
+    def log_entries(self):
+        """Return the deduplication counts and ratios as `key: value` entries for the run log."""
+        items = max(self.stats["items"], 1)
+        entries = {
+            "Unique Items": self.stats["unique"],
+            "Exact Duplicates": self.stats["exact_duplicates"],
+            "Exact Duplicate Ratio": round(self.stats["exact_duplicates"] / items, 4),
+        }
+        if self.near_duplicate_threshold is not None:
+            entries["Near Duplicates"] = self.stats["near_duplicates"]
+            entries["Near Duplicate Ratio"] = round(self.stats["near_duplicates"] / items, 4)
+        entries["Dedup Ratio"] = round((self.stats["exact_duplicates"] + self.stats["near_duplicates"]) / items, 4)
+        return entries
@@ -0,0 +1,88 @@
+import os
+import json
+
+# Input formats by file extension
+INPUT_FORMATS = {".csv": "csv", ".tsv": "csv", ".parquet": "parquet", ".pq": "parquet", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def get_input_format(path, input_format=None):
+    """Return the format of an input path: "csv", "parquet", "jsonl" or "txt" (a directory of reports)."""
+    if input_format is not None:
+        if input_format not in ["csv", "parquet", "jsonl", "txt"]:
+            raise ValueError(f"Unknown input format {input_format!r}. Use 'csv', 'parquet', 'jsonl' or 'txt'.")
+        return input_format
+    if os.path.isdir(path):
+        return "txt"
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in INPUT_FORMATS:
+        raise ValueError(f"Cannot infer the format of {path}. Pass the input format explicitly.")
+    return INPUT_FORMATS[extension]
+
+
+def load_items(path, columns=None, input_format=None, text_field="report", chunk_size=1000):
+    """
+    Lazily yield the items of a corpus as dictionaries, without loading the whole corpus in memory.
+
+    Args:
+        path (str): A CSV, TSV, Parquet or JSONL file, or a directory of `.txt` reports
+        columns (dict): Map from prompt placeholder to input column, e.g. {"report": "findings_text"}.
+            Other columns are kept under their own name.
+        input_format (str): "csv", "parquet", "jsonl" or "txt". Inferred from `path` if None.
+        text_field (str): Field that holds the text of each `.txt` report; the file name (without
+            extension) is stored under "file"
+        chunk_size (int): Number of rows read at a time from CSV and Parquet files
+
+    Examples:
+        engine(load_items("reports.parquet", columns={"report": "report_text"}))
+    """
+    input_format = get_input_format(path, input_format)
+    if input_format == "csv":
+        items = _load_csv(path, chunk_size)
+    elif input_format == "parquet":
+        items = _load_parquet(path, chunk_size)
+    elif input_format == "jsonl":
+        items = _load_jsonl(path)
+    else:
+        items = _load_txt(path, text_field)
+
+    renames = {column: placeholder for placeholder, column in (columns or {}).items()}
+    for item in items:
+        if renames:
+            missing = [column for column in renames if column not in item]
+            if missing:
+                raise ValueError(f"Input {path} has no column(s) {missing}")
+            item = {renames.get(key, key): value for key, value in item.items()}
+        yield item
+
+
+def _load_csv(path, chunk_size):
+    import pandas as pd
+    separator = "\t" if path.lower().endswith(".tsv") else ","
+    # Values are read as text so that they can be placed in prompts as they are in the file
+    for chunk in pd.read_csv(path, sep=separator, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        column_names = list(chunk.columns)
+        for row in chunk.itertuples(index=False, name=None):
+            yield dict(zip(column_names, row))
+
+
+def _load_parquet(path, chunk_size):
+    # pyarrow is optional; `sinks` records whether it is installed
+    from . import sinks
+    if os.environ['HAS_PYARROW'] != "True":
+        raise ImportError("Parquet input requires the `pyarrow` package to be installed.")
+    for batch in sinks.pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield from batch.to_pylist()
+
+
+def _load_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _load_txt(path, text_field):
+    file_names = sorted(entry.name for entry in os.scandir(path) if entry.is_file() and entry.name.endswith(".txt"))
+    for file_name in file_names:
+        with open(os.path.join(path, file_name), "r", encoding="utf-8") as f:
+            yield {"file": os.path.splitext(file_name)[0], text_field: f.read()}
@@ -13,9 +13,27 @@ try:
 except ImportError:
     pass
 
+PLACEHOLDER_PATTERN = re.compile(r"{{([^{}]*)}}")
+
+def compile_template(template):
+    """
+    Split a template into (literal, placeholder) segments.
+    
+    The placeholder of the last segment is None; e.g. "Report: {{report}}." becomes
+    [("Report: ", "report"), (".", None)].
+    """
+    segments = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(template):
+        segments.append((template[position:match.start()], match.group(1)))
+        position = match.end()
+    segments.append((template[position:], None))
+    return tuple(segments)
+
 class Prompt:
     def __init__(self, prompt_file, debug=False):
         self.debug = debug
+        self._compiled_templates = {}
 
         assert prompt_file.endswith(".toml"), "Prompt file should be a TOML file."
         self.prompt_file = os.path.abspath(prompt_file)
@@ -41,6 +59,10 @@ class Prompt:
             print(self.num_turns)
         
         assert len(self.user_prompts) == len(self.response_templates) == len(self.stop_tags), "Number of user prompts, response templates, and stop tags should be the same."
+        
+        # Parse the placeholder positions once; templates changed later on are compiled on first use
+        for template in [self.system_prompt, *self.user_prompts, *self.response_templates]:
+            self.get_compiled_template(template)
     
     def process_single_schema(self, schema):
         processed_schema = []
@@ -138,6 +160,99 @@ class Prompt:
             
         return data, raw_data
 
+    def get_compiled_template(self, template):
+        """Return the cached segments of `template`, compiling it on first use."""
+        compiled = self._compiled_templates.get(template)
+        if compiled is None:
+            compiled = compile_template(template)
+            self._compiled_templates[template] = compiled
+        return compiled
+    
+    def render_template(self, template, schema, item, _depth=0):
+        """
+        Fill the placeholders of `template` without modifying the prompt.
+        
+        Values from `item` take precedence and are inserted verbatim. Values from `schema` are
+        themselves templates (e.g. an `intro_prompt` containing `{{report}}`) and are rendered
+        recursively. Unknown placeholders are left untouched.
+        
+        Args:
+            template (str): Template string
+            schema (dict): Schema the prompt is rendered for
+            item (dict): Item being processed
+            
+        Returns:
+            str: The rendered string
+        """
+        return self._render_segments(self.get_compiled_template(template), schema, item, _depth)
+    
+    def render_shared_prefix(self, template, schema, item):
+        """
+        Render `template` split at its first schema-specific placeholder.
+        
+        The prefix only depends on the item, so it is identical for every schema of that item
+        and can be reused by provider-side prompt caching.
+        
+        Returns:
+            tuple: (prefix: str, tail: str)
+        """
+        segments = self.get_compiled_template(template)
+        for position, (literal, name) in enumerate(segments):
+            if name is not None and name not in item and name in schema:
+                prefix = self._render_segments(segments[:position], schema, item) + literal
+                tail = self._render_segments((("", name),) + segments[position + 1:], schema, item)
+                return prefix, tail
+        return self._render_segments(segments, schema, item), ""
+    
+    def get_schema_placeholders(self):
+        """Return the names of the placeholders filled from schema fields rather than from the item."""
+        return {key for schema in self.schemas.schemas for key in schema}
+    
+    def get_placeholders(self):
+        """
+        Return the names of the placeholders of the user prompts and response templates, including
+        those nested in schema fields (e.g. `{{report}}` in an `intro_prompt`), in order of appearance.
+        """
+        names = {}
+        templates = [*self.user_prompts, *self.response_templates]
+        templates += [value for schema in self.schemas.schemas for value in schema.values() if isinstance(value, str)]
+        for template in templates:
+            for _, name in self.get_compiled_template(template):
+                if name is not None:
+                    names[name] = True
+        return list(names)
+
+    def _render_segments(self, segments, schema, item, _depth=0):
+        parts = []
+        for literal, name in segments:
+            parts.append(literal)
+            if name is None:
+                continue
+            
+            if name in item:
+                value = item[name]
+                parts.append(value if isinstance(value, str) else str(value))
+            elif name in schema:
+                value = schema[name]
+                value = value if isinstance(value, str) else str(value)
+                if "{{" in value and _depth < 10:
+                    value = self.render_template(value, schema, item, _depth + 1)
+                parts.append(value)
+            else:
+                parts.append("{{" + name + "}}")
+        return "".join(parts)
+    
+    def render(self, schema, item):
+        """
+        Render the user prompts and response templates of every turn for a schema and an item.
+        
+        Returns:
+            tuple: (user_prompts: list, response_templates: list)
+        """
+        user_prompts = [self.render_template(template, schema, item) for template in self.user_prompts]
+        response_templates = [self.render_template(template, schema, item) for template in self.response_templates]
+        return user_prompts, response_templates
+    
     def replace_placeholders(self, item):
         for key in item:
             if "{{"+key+"}}" in self.system_prompt:
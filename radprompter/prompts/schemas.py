@@ -1,17 +1,105 @@
+import re
 import json
+import math
+import heapq
+import hashlib
 from copy import deepcopy
-from pydantic import BaseModel, Field, create_model
+from pydantic import BaseModel, Field, ValidationError, create_model
 from typing import Literal, Union, Optional
 from enum import Enum
 
+SCHEMA_HINT_PREFIX = "\n\nRespond with a JSON object following this schema: "
+
+# Pydantic models and their JSON schemas, keyed by the hash of the schema definitions they were built from
+_PYDANTIC_MODELS = {}
+_JSON_SCHEMAS = {}
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+NUMBER_PATTERN = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def get_json_schema(model):
+    """Return the JSON schema of a Pydantic model, computed once per model."""
+    json_schema = _JSON_SCHEMAS.get(model)
+    if json_schema is None:
+        json_schema = _JSON_SCHEMAS[model] = model.model_json_schema()
+    return json_schema
+
+
+def get_base_hint(schema):
+    """Return the hint of a schema without the JSON schema appended by `populate_pydantic_models`."""
+    return schema.get('hint', '').split(SCHEMA_HINT_PREFIX)[0]
+
+
+def repair_json(text):
+    """
+    Best-effort recovery of a JSON object from a model answer.
+    
+    Handles answers wrapped in code fences or surrounded by text, and answers truncated by the
+    token limit (open strings, arrays and objects are closed, a dangling key is dropped).
+    
+    Args:
+        text (str): The answer of the model
+        
+    Returns:
+        dict: The recovered object
+        
+    Raises:
+        ValueError: If no JSON object can be recovered
+    """
+    fenced = CODE_FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found in the response")
+    text = text[start:]
+    
+    # Scan the object, remembering where it ends or which brackets are still open at the end of the text
+    stack, in_string, escaped = [], False, False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return json.loads(text[:position + 1])
+    
+    # Truncated: close the open string, drop an incomplete trailing member, close the brackets
+    if in_string:
+        text += "\\" if escaped else ""
+        text += '"'
+    text = text.rstrip()
+    if stack and stack[-1] == "}":
+        # A key without a value (`, "key"` or `, "key":`) cannot be completed
+        text = re.sub(r'(,|\{)\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', r"\1", text).rstrip()
+    text = text.rstrip(",").rstrip()
+    try:
+        return json.loads(text + "".join(reversed(stack)))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to repair JSON response: {e}")
+
 
 class Schemas:
     def __init__(self, prompt, schemas):
         self.prompt = prompt
         self.schemas = schemas
+        self.group_schemas = {}
+        # Validate the dependency graph upfront (unknown schemas, cycles)
+        self.get_dependency_order()
 
-    def create_pydantic_model_for_schema(self, schema):
-        """Create a Pydantic model for a single schema"""
+    def get_field_definition(self, schema):
+        """Return the (type, FieldInfo) pair describing the answer of a single schema"""
         variable_name = schema['variable_name']
         schema_type = schema['type']
         
@@ -22,34 +110,133 @@ class Schemas:
             options = schema['options']
             enum_class = Enum(f"{variable_name.title()}Enum", {opt: opt for opt in options})
             field_type = enum_class
-            field_info = Field(description=schema.get('hint', ""))
+            field_info = Field(description=get_base_hint(schema))
         elif schema_type == "int":
             field_type = int
-            field_info = Field(description=schema.get('hint', ""))
+            field_info = Field(description=get_base_hint(schema))
         elif schema_type == "float":
             field_type = float
-            field_info = Field(description=schema.get('hint', ""))
+            field_info = Field(description=get_base_hint(schema))
         elif schema_type == "string":
             field_type = str
-            field_info = Field(description=schema.get('hint', ""))
+            field_info = Field(description=get_base_hint(schema))
         else:
             raise ValueError(f"Unknown schema type: {schema_type}")
         
-        # Create the dynamic model
-        model_name = f"{variable_name.title()}Model"
-        model_fields = {variable_name: (field_type, field_info)}
-        
-        pydantic_model = create_model(model_name, **model_fields)
+        return field_type, field_info
+
+    @staticmethod
+    def get_definition_hash(schemas):
+        """Hash the parts of schema definitions that determine their Pydantic model"""
+        definitions = [
+            {"variable_name": schema['variable_name'], "type": schema['type'], "options": schema.get('options'), "hint": get_base_hint(schema)}
+            for schema in schemas
+        ]
+        return hashlib.md5(json.dumps(definitions, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def create_pydantic_model_for_schema(self, schema):
+        """Create a Pydantic model for a single schema, or reuse the model of an identical definition"""
+        key = ("schema", self.get_definition_hash([schema]))
+        pydantic_model = _PYDANTIC_MODELS.get(key)
+        if pydantic_model is None:
+            variable_name = schema['variable_name']
+            
+            # Create the dynamic model
+            model_name = f"{variable_name.title()}Model"
+            model_fields = {variable_name: self.get_field_definition(schema)}
+            
+            pydantic_model = _PYDANTIC_MODELS[key] = create_model(model_name, **model_fields)
         return pydantic_model
 
     def populate_pydantic_models(self):
-        """Populate Pydantic models for all schemas"""
+        """Populate Pydantic models for all schemas (repeated calls leave the hints unchanged)"""
         for schema in self.schemas:
             if schema['type'] != "default":
                 schema['pydantic_model'] = self.create_pydantic_model_for_schema(schema)
                 if schema.get('show_options_in_hint', False):
-                    schema_text = f"\n\nRespond with a JSON object following this schema: {schema['pydantic_model'].model_json_schema()}"
-                    schema['hint'] += schema_text
+                    schema_text = f"{SCHEMA_HINT_PREFIX}{get_json_schema(schema['pydantic_model'])}"
+                    schema['hint'] = get_base_hint(schema) + schema_text
+    
+    def resolve_groups(self, groups):
+        """
+        Resolve the schema groups answered together in a single structured-output call.
+        
+        Args:
+            groups (bool or list): True to put all independent schemas in one group, or a list of
+                                   groups, each a list of schema variable names
+                                   
+        Returns:
+            list: List of groups, each a list of schema indices
+            
+        Raises:
+            ValueError: If a group references an unknown or dependent schema, or a schema is used twice
+        """
+        if groups is True:
+            groups = [[schema['variable_name'] for schema in self.schemas if 'depends_on' not in schema]]
+        
+        index_by_name = {schema['variable_name']: i for i, schema in enumerate(self.schemas)}
+        resolved = []
+        seen = set()
+        for group in groups:
+            indices = []
+            for name in group:
+                if name not in index_by_name:
+                    raise ValueError(f"Schema group references unknown schema '{name}'")
+                if 'depends_on' in self.schemas[index_by_name[name]]:
+                    raise ValueError(f"Schema '{name}' depends on another schema and cannot be part of a schema group")
+                if name in seen:
+                    raise ValueError(f"Schema '{name}' is part of more than one schema group")
+                seen.add(name)
+                indices.append(index_by_name[name])
+            if len(indices) > 0:
+                resolved.append(indices)
+        return resolved
+    
+    def populate_group_models(self, groups):
+        """
+        Create the composite schema and Pydantic model of each group.
+        
+        Args:
+            groups (list): List of groups, each a list of schema indices (see `resolve_groups`)
+        """
+        self.group_schemas = {}
+        for group in groups:
+            schemas = [self.schemas[i] for i in group]
+            
+            # The composite schema fills the usual placeholders for all members at once
+            # Member hints lose their single-field JSON schema, the composite one is appended instead
+            hints = [get_base_hint(schema).strip() for schema in schemas]
+            key = ("group", self.get_definition_hash(schemas))
+            if key not in _PYDANTIC_MODELS:
+                model_fields = {schema['variable_name']: self.get_field_definition(schema) for schema in schemas}
+                _PYDANTIC_MODELS[key] = create_model("CompositeModel", **model_fields)
+            group_schema = {
+                "variable_name": ", ".join(schema['variable_name'] for schema in schemas),
+                "type": "composite",
+                "hint": "\n".join(f"{schema['variable_name']}:\n{hint}\n" for schema, hint in zip(schemas, hints)),
+                "pydantic_model": _PYDANTIC_MODELS[key],
+            }
+            if any(schema.get('show_options_in_hint', False) for schema in schemas):
+                group_schema['hint'] += f"{SCHEMA_HINT_PREFIX}{get_json_schema(group_schema['pydantic_model'])}"
+            # Other text fields (e.g. an `intro_prompt`) combine the distinct non-empty values of the members
+            other_keys = []
+            for schema in schemas:
+                for key, value in schema.items():
+                    if key not in group_schema and key not in other_keys and isinstance(value, str):
+                        other_keys.append(key)
+            for key in other_keys:
+                values = []
+                for schema in schemas:
+                    value = schema.get(key)
+                    if isinstance(value, str) and value and value not in values:
+                        values.append(value)
+                group_schema[key] = "\n".join(values)
+            
+            self.group_schemas[tuple(group)] = group_schema
+    
+    def get_group_schema(self, group):
+        """Get the composite schema of a group created by `populate_group_models`"""
+        return self.group_schemas[tuple(group)]
     
     def get_pydantic_model(self, index):
         """Get the Pydantic model for a specific schema"""
@@ -113,31 +300,82 @@ class Schemas:
         # No matching responses met the condition
         return False, default_value
     
+    def get_dependency_graph(self):
+        """
+        Build the dependency graph declared through the `depends_on` fields.
+        
+        Returns:
+            dict: Mapping of each schema index to the list of schema indices it depends on
+            
+        Raises:
+            ValueError: If a schema depends on an unknown schema or on itself
+        """
+        index_by_name = {schema['variable_name']: i for i, schema in enumerate(self.schemas)}
+        
+        graph = {}
+        for i, schema in enumerate(self.schemas):
+            graph[i] = []
+            if 'depends_on' not in schema:
+                continue
+            
+            dependency_schema = schema['depends_on']['schema']
+            if dependency_schema not in index_by_name:
+                raise ValueError(f"Schema '{schema['variable_name']}' depends on unknown schema '{dependency_schema}'")
+            if index_by_name[dependency_schema] == i:
+                raise ValueError(f"Schema '{schema['variable_name']}' cannot depend on itself")
+            graph[i].append(index_by_name[dependency_schema])
+        
+        return graph
+    
     def get_dependency_order(self):
         """
         Get the order in which schemas should be processed based on dependencies.
         
+        Schemas are topologically sorted (Kahn's algorithm). Among the schemas that are ready,
+        independent schemas come first and the order of declaration in the prompt file is kept.
+        
         Returns:
             list: List of schema indices in dependency order
+            
+        Raises:
+            ValueError: If the dependencies contain a cycle
         """
-        # Simple topological sort for dependencies
-        independent_schemas = []
-        dependent_schemas = []
+        graph = self.get_dependency_graph()
         
-        for i, schema in enumerate(self.schemas):
-            if 'depends_on' not in schema:
-                independent_schemas.append(i)
-            else:
-                dependent_schemas.append(i)
+        remaining_parents = {i: len(parents) for i, parents in graph.items()}
+        children = {i: [] for i in graph}
+        for i, parents in graph.items():
+            for parent in parents:
+                children[parent].append(i)
+        
+        def priority(i):
+            return (len(graph[i]) > 0, i)
         
-        # For now, process independent schemas first, then dependent ones
-        # In a more complex implementation, we'd do proper topological sorting
-        return independent_schemas + dependent_schemas
+        ready = [priority(i) for i in graph if remaining_parents[i] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, i = heapq.heappop(ready)
+            order.append(i)
+            for child in children[i]:
+                remaining_parents[child] -= 1
+                if remaining_parents[child] == 0:
+                    heapq.heappush(ready, priority(child))
+        
+        if len(order) != len(graph):
+            cycle = [self.schemas[i]['variable_name'] for i in graph if i not in order]
+            raise ValueError(f"Schema dependencies contain a cycle between: {cycle}")
+        
+        return order
     
     def parse_response(self, response_json, schema_index):
         """
         Extract just the response value from a Pydantic JSON response.
         
+        The response is validated against the schema's Pydantic model in a single pass. Responses
+        that do not validate as they are (code fences, text around the object, truncated objects,
+        select options in the wrong case, numbers given as text) are repaired when possible.
+        
         Args:
             response_json (str or dict): The JSON response from the model
             schema_index (int): Index of the schema that was used
@@ -146,34 +384,134 @@ class Schemas:
             The extracted value without the variable name key
             
         Raises:
-            ValueError: If JSON parsing fails or expected key is not found
+            ValueError: If JSON parsing fails, the expected key is not found or the value is invalid
             IndexError: If schema_index is out of range
         """
         if schema_index >= len(self.schemas):
             raise IndexError(f"Schema index {schema_index} out of range. Available schemas: {len(self.schemas)}")
         
         schema = self.schemas[schema_index]
-        if schema.get('pydantic_model') is None:
+        pydantic_model = schema.get('pydantic_model')
+        if pydantic_model is None:
             return response_json
         
         variable_name = schema['variable_name']
         
-        # Handle string JSON input
+        # Fast path: a well-formed answer is parsed and validated by pydantic-core in one pass
         if isinstance(response_json, str):
             try:
-                response_dict = json.loads(response_json)
-            except json.JSONDecodeError as e:
-                raise ValueError(f"Failed to parse JSON response: {e}")
-        elif isinstance(response_json, dict):
-            response_dict = response_json
-        else:
-            raise ValueError(f"Expected string or dict, got {type(response_json)}")
+                return self._get_field_value(pydantic_model.model_validate_json(response_json), variable_name)
+            except ValidationError:
+                pass
         
+        response_dict = self._load_response(response_json)
         # Extract the value for the variable name
         if variable_name not in response_dict:
             raise ValueError(f"Expected key '{variable_name}' not found in response. Available keys: {list(response_dict.keys())}")
         
-        return response_dict[variable_name]
+        return self.coerce_value(schema, response_dict[variable_name])
+    
+    def parse_group_response(self, response_json, group):
+        """
+        Split the response of a composite model back into the answers of its schemas.
+        
+        Args:
+            response_json (str or dict): The JSON response from the model
+            group (list): Schema indices of the group
+            
+        Returns:
+            dict: Mapping of schema index to its answer; schemas missing from the response or with an
+                  invalid answer are left out
+            
+        Raises:
+            ValueError: If JSON parsing fails
+        """
+        if isinstance(response_json, str):
+            group_schema = self.group_schemas.get(tuple(group))
+            if group_schema is not None:
+                try:
+                    parsed = group_schema['pydantic_model'].model_validate_json(response_json)
+                    return {
+                        schema_index: self._get_field_value(parsed, self.schemas[schema_index]['variable_name'])
+                        for schema_index in group
+                    }
+                except ValidationError:
+                    pass
+        
+        response_dict = self._load_response(response_json)
+        parsed_response = {}
+        for schema_index in group:
+            schema = self.schemas[schema_index]
+            if schema['variable_name'] in response_dict:
+                try:
+                    parsed_response[schema_index] = self.coerce_value(schema, response_dict[schema['variable_name']])
+                except ValueError:
+                    continue
+        return parsed_response
+    
+    @staticmethod
+    def coerce_value(schema, value):
+        """
+        Convert an answer to the type of its schema.
+        
+        Select answers are matched to the options ignoring case and surrounding whitespace, and int and
+        float answers may be given as text (e.g. "3" or "3.5 cm").
+        
+        Raises:
+            ValueError: If the answer cannot be converted
+        """
+        schema_type = schema['type']
+        if schema_type == "select":
+            if value in schema['options']:
+                return value
+            normalized = str(value).strip().strip('"').casefold()
+            for option in schema['options']:
+                if option.strip().casefold() == normalized:
+                    return option
+            raise ValueError(f"Answer {value!r} to '{schema['variable_name']}' is not one of {schema['options']}")
+        if schema_type in ["int", "float"]:
+            if isinstance(value, bool) or value is None:
+                raise ValueError(f"Answer {value!r} to '{schema['variable_name']}' is not a number")
+            if isinstance(value, str):
+                match = NUMBER_PATTERN.search(value)
+                if match is None:
+                    raise ValueError(f"Answer {value!r} to '{schema['variable_name']}' is not a number")
+                value = float(match.group())
+            # `json.loads` turns `1e999`, `Infinity` and `NaN` into non-finite floats, and keeps huge integers as ints
+            try:
+                number = float(value)
+            except OverflowError:
+                number = math.inf
+            if not math.isfinite(number):
+                raise ValueError(f"Answer {value!r} to '{schema['variable_name']}' is not a finite number")
+            if schema_type == "float":
+                return number
+            if not number.is_integer():
+                raise ValueError(f"Answer {value!r} to '{schema['variable_name']}' is not an integer")
+            return int(value)
+        if schema_type == "string" and value is not None and not isinstance(value, str):
+            return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+        return value
+    
+    @staticmethod
+    def _get_field_value(parsed, variable_name):
+        value = getattr(parsed, variable_name)
+        return value.value if isinstance(value, Enum) else value
+    
+    @staticmethod
+    def _load_response(response_json):
+        """Load a response as a dictionary, repairing fenced or truncated JSON"""
+        if isinstance(response_json, dict):
+            return response_json
+        if not isinstance(response_json, str):
+            raise ValueError(f"Expected string or dict, got {type(response_json)}")
+        try:
+            response_dict = json.loads(response_json)
+        except json.JSONDecodeError:
+            response_dict = repair_json(response_json)
+        if not isinstance(response_dict, dict):
+            raise ValueError(f"Expected a JSON object, got {type(response_dict).__name__}")
+        return response_dict
     
     def __getitem__(self, index):
         schema = self.schemas[index]
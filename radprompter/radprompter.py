@@ -1,17 +1,71 @@
 import os
+import json
 import pandas as pd
 import re
 import warnings
-from copy import deepcopy
+import time
+import asyncio
+from collections import deque, OrderedDict
 from tqdm import tqdm
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import csv
+from concurrent.futures import ThreadPoolExecutor
 from .clients import HuggingFaceClient, OpenAIClient
+from .checkpoint import Checkpoint
+from .sinks import SinkWriter, get_sink_class
+from .sharding import shard_of, get_part_file
+from .dedup import Deduplicator
+from .telemetry import Telemetry
 from .__version__ import __version__
 
+def _run_sync(coroutine):
+    """
+    Run a coroutine to completion from synchronous code.
+    
+    When called from inside a running event loop (e.g. a Jupyter notebook), the coroutine
+    is executed on a fresh event loop in a helper thread instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def iter_items(items):
+    """
+    Lazily yield the items to process as dictionaries.
+    
+    Accepts a single item (dict), a pandas DataFrame, or any iterable of items and/or
+    DataFrames, such as a generator over a database cursor or `pd.read_csv(..., chunksize=...)`.
+    """
+    if isinstance(items, dict):
+        yield items
+    elif isinstance(items, pd.DataFrame):
+        columns = list(items.columns)
+        for row in items.itertuples(index=False, name=None):
+            yield dict(zip(columns, row))
+    elif isinstance(items, pd.Series):
+        yield items.to_dict()
+    else:
+        for item in items:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                yield from iter_items(item)
+            else:
+                yield item
+
+def count_items(items):
+    """Return the number of items without consuming them, or None if it cannot be known upfront."""
+    if isinstance(items, (dict, pd.Series)):
+        return 1
+    if isinstance(items, pd.DataFrame):
+        return len(items)
+    if isinstance(items, (list, tuple)) and not any(isinstance(item, (pd.DataFrame, pd.Series)) for item in items):
+        return len(items)
+    return None
+
 class RadPrompter():
-    def __init__(self, client, prompt, output_file, hide_blocks=False, concurrency=1, max_generation_tokens=4096, use_pydantic=True):
+    def __init__(self, client, prompt, output_file, hide_blocks=False, concurrency=1, max_generation_tokens=4096, use_pydantic=True, cache=None, resume=False, checkpoint_interval=5.0, max_queued_items=None, schema_groups=None, prefix_caching=False, output_format=None, write_batch_size=256, write_interval=1.0, ordered_output=False, max_reorder_buffer=1000, shard_index=None, num_shards=None, shard_key=None, option_scoring=False, deduplicate=False, near_duplicate_threshold=None, dedup_cache_size=10000, spans_file=None):
         self.client = client
         self.prompt = prompt
         self.hide_blocks = hide_blocks
@@ -19,24 +73,69 @@ class RadPrompter():
         self.output_file = output_file
         self.max_generation_tokens = max_generation_tokens
         self.use_pydantic = use_pydantic
-        assert self.output_file.endswith(".csv"), "Output file must be a .csv file"
+        self.cache = cache
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.max_queued_items = max_queued_items
+        self.schema_groups = schema_groups
+        self.prefix_caching = prefix_caching
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.ordered_output = ordered_output
+        self.max_reorder_buffer = max_reorder_buffer
+        assert self.max_reorder_buffer >= 1, "`max_reorder_buffer` must be at least 1"
+        self.option_scoring = option_scoring
+        # A near-duplicate threshold implies deduplication
+        self.deduplicate = deduplicate or near_duplicate_threshold is not None
+        self.near_duplicate_threshold = near_duplicate_threshold
+        if self.near_duplicate_threshold is not None and not 0.0 < self.near_duplicate_threshold <= 1.0:
+            raise ValueError(f"`near_duplicate_threshold` must be in (0, 1], got {self.near_duplicate_threshold}.")
+        # Number of unique items (and their results) kept for later duplicates
+        self.dedup_cache_size = dedup_cache_size
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.shard_key = shard_key
+        if (self.shard_index is None) != (self.num_shards is None):
+            raise ValueError("`shard_index` and `num_shards` must be given together.")
+        if self.num_shards is not None:
+            if not 0 <= self.shard_index < self.num_shards:
+                raise ValueError(f"`shard_index` must be between 0 and {self.num_shards - 1}, got {self.shard_index}.")
+            # Every shard writes its own part file, combined afterwards with `merge_shards`
+            self.output_file = get_part_file(self.output_file, self.shard_index, self.num_shards)
+        # Latency, token usage and cost of every model call of the last run
+        self.telemetry = Telemetry(model=self.client.model, spans_path=spans_file)
+        # Live scheduler counters, updated while the engine runs
+        self.stats = {"queued": 0, "in_flight": 0, "completed": 0}
+        self.sink_class = get_sink_class(self.output_file, output_format)
+        if self.resume and not self.sink_class.supports_resume:
+            raise ValueError(f"{self.sink_class.__name__} output cannot be resumed. Use a CSV or JSONL output file or pass `resume=False`.")
         file_exists = os.path.isfile(self.output_file)
         
-        if file_exists:
+        if file_exists and not self.resume:
             warnings.warn(f"Output file {self.output_file} already exists. The file will be **replaced** if you proceed with running the engine.")
         
         if isinstance(self.client, OpenAIClient) and self.prompt.response_templates.count("") != prompt.num_turns:
             warnings.warn("OpenAI models do not accept response templates and will be ignored.")
             self.prompt.response_templates = [""]*prompt.num_turns
             
-        if isinstance(self.client, HuggingFaceClient) and self.concurrency > 1:
-            warnings.warn("HuggingFace client does not support concurrency > 1 and will be set to 1.")
+        if isinstance(self.client, HuggingFaceClient) and self.client.batch_size <= 1 and self.concurrency > 1:
+            warnings.warn("HuggingFace client does not support concurrency > 1 without batching (`batch_size` > 1) and will be set to 1.")
             self.concurrency = 1
         
-        if isinstance(self.client, HuggingFaceClient) and self.use_pydantic:
-            warnings.warn("HuggingFace client does not support Pydantic models and will be set to False.")
+        if isinstance(self.client, HuggingFaceClient) and self.use_pydantic and not self.client.constrained_decoding:
+            warnings.warn("HuggingFace client only supports Pydantic models with `constrained_decoding=True`; `use_pydantic` will be set to False.")
             self.use_pydantic = False
         
+        if self.option_scoring and not self.client.supports_scoring:
+            warnings.warn(f"{type(self.client).__name__} cannot score options and `option_scoring` will be set to False.")
+            self.option_scoring = False
+        
+        if self.max_queued_items is None:
+            self.max_queued_items = self.concurrency
+        
+        if self.cache is not None:
+            self.client.cache = self.cache
+        
         # Populate Pydantic models if use_pydantic is True
         if self.use_pydantic:
             if len(self.prompt.schemas.schemas) == 1 and self.prompt.schemas.schemas[0]['type']=="default":
@@ -44,6 +143,20 @@ class RadPrompter():
             else:
                 self.prompt.schemas.populate_pydantic_models()
         
+        # Schema groups need structured output to split the composite answer
+        if self.schema_groups and not self.use_pydantic:
+            warnings.warn("Schema groups require Pydantic models and will be ignored.")
+            self.schema_groups = None
+        
+        if self.schema_groups:
+            self.schema_groups = self.prompt.schemas.resolve_groups(self.schema_groups)
+            self.prompt.schemas.populate_group_models(self.schema_groups)
+        else:
+            self.schema_groups = []
+        
+        if self.prefix_caching:
+            self._check_shared_prefix()
+        
         if self.use_pydantic:
             if self.prompt.stop_tags.count("") != self.prompt.num_turns or self.prompt.response_templates.count("") != self.prompt.num_turns:
                 warnings.warn("Pydantic models do not support stop tags and response templates and will be ignored.")
@@ -61,136 +174,457 @@ class RadPrompter():
             "Prompt Version": self.prompt.version,
             "Prompt Hash": self.prompt.md5_hash,
             "Concurrency Factor": self.concurrency,
+            "Max Queued Items": self.max_queued_items,
             "Use Pydantic": self.use_pydantic,
+            "Prefix Caching": self.prefix_caching,
+            "Schema Groups": [[self.prompt.schemas.schemas[i]['variable_name'] for i in group] for group in self.schema_groups],
+            "Response Cache": (self.cache.path or "memory") if self.cache is not None else None,
+            "Ordered Output": self.ordered_output,
+            "Option Scoring": self.option_scoring,
+            "Deduplication": (f"near (threshold={self.near_duplicate_threshold})" if self.near_duplicate_threshold is not None else "exact") if self.deduplicate else None,
         }
+        if self.num_shards is not None:
+            self.log["Shard"] = f"{self.shard_index}/{self.num_shards}"
+            self.log["Shard Key"] = self.shard_key
+        if getattr(self.client, "rate_limiter", None) is not None:
+            self.log["Requests Per Minute"] = self.client.requests_per_minute
+            self.log["Tokens Per Minute"] = self.client.tokens_per_minute
+        if getattr(self.client, "concurrency_controller", None) is not None:
+            self.log["Adaptive Concurrency"] = f"{self.client.concurrency_controller.min_limit}-{self.client.concurrency_controller.max_limit}"
+        retry_policy = getattr(self.client, "retry_policy", None)
+        if retry_policy is not None:
+            self.log["Retry Policy"] = f"max_attempts={retry_policy.max_attempts}, deadline={retry_policy.deadline}, hedge={retry_policy.hedge}"
         
     def process_single_item(self, item, index):
-        prompt = deepcopy(self.prompt)
-            
-        messages = [
-            {"role": "system", "content": prompt.system_prompt},
-        ]
-        item_response = []
+        return _run_sync(self.aprocess_single_item(item, index))
+    
+    async def aprocess_single_item(self, item, index):
+        prompt = self.prompt
         previous_responses = {}  # Store responses for dependency checking
         
         # Get schemas in dependency order
         schema_order = prompt.schemas.get_dependency_order()
         
-        for schema_idx in schema_order:
-            schema = prompt.schemas.schemas[schema_idx]
+        # Units of work: schema groups answered in a single call come first (they only hold
+        # independent schemas), followed by the remaining schemas in dependency order
+        grouped = {schema_idx for group in self.schema_groups for schema_idx in group}
+        units = [group for group in self.schema_groups] + [[schema_idx] for schema_idx in schema_order if schema_idx not in grouped]
+        responses = {}
+        
+        if not self.hide_blocks:
+            # Schemas share one conversation, so they have to be asked one after another
+            messages = [
+                {"role": "system", "content": prompt.system_prompt},
+            ]
+            for unit in units:
+                unit_responses, messages = await self._aprocess_unit(prompt, unit, item, index, messages, previous_responses)
+                responses.update(unit_responses)
+        else:
+            # With hidden blocks every unit has its own conversation: independent units run
+            # concurrently and each dependent schema starts as soon as the schemas it depends on resolve
+            dependency_graph = prompt.schemas.get_dependency_graph()
+            unit_tasks = {}
+            
+            async def run_unit(unit):
+                for schema_idx in unit:
+                    for parent_idx in dependency_graph[schema_idx]:
+                        await unit_tasks[parent_idx]
+                messages = [
+                    {"role": "system", "content": prompt.system_prompt},
+                ]
+                unit_responses, _ = await self._aprocess_unit(prompt, unit, item, index, messages, previous_responses)
+                return unit_responses
+            
+            tasks = []
+            for unit in units:
+                task = asyncio.ensure_future(run_unit(unit))
+                tasks.append(task)
+                for schema_idx in unit:
+                    unit_tasks[schema_idx] = task
+            
             try:
-                # Check if this schema should be processed based on dependencies
-                should_process, default_value = prompt.schemas.should_process_schema(schema_idx, previous_responses)
+                for unit_responses in await asyncio.gather(*tasks):
+                    responses.update(unit_responses)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        
+        item_response = [response for schema_idx in schema_order for response in responses[schema_idx]]
+        return index, item_response
+    
+    async def _aprocess_unit(self, prompt, unit, item, index, messages, previous_responses):
+        if len(unit) == 1:
+            schema_response, messages = await self._aprocess_schema(prompt, unit[0], item, index, messages, previous_responses)
+            return {unit[0]: schema_response}, messages
+        return await self._aprocess_schema_group(prompt, unit, item, index, messages, previous_responses)
+    
+    async def _aprocess_schema_group(self, prompt, group, item, index, messages, previous_responses):
+        """Ask for all schemas of a group in a single structured-output call and split the answer per schema"""
+        schemas = [prompt.schemas.schemas[schema_idx] for schema_idx in group]
+        try:
+            group_schema = prompt.schemas.get_group_schema(group)
+            user_prompts, response_templates = self._render_prompts(prompt, group_schema, item)
+            
+            group_responses = {schema_idx: [] for schema_idx in group}
+            for i in range(prompt.num_turns):
+                messages.append({"role": "user", "content": user_prompts[i]})
+                if prompt.response_templates[i] != "":
+                    messages.append({"role": "assistant", "content": response_templates[i]})
                 
-                if not should_process:
-                    # Use default value for skipped schema
-                    response_key = f"{schema['variable_name']}_response"
-                    previous_responses[response_key] = default_value
-                    item_response.append({response_key: default_value})
-                    continue
+                with self.telemetry.track(group_schema['variable_name'], i, index):
+                    response, messages = await self.client.aask_model(
+                        messages, 
+                        prompt.stop_tags[i], 
+                        max_tokens=self.max_generation_tokens, 
+                        response_format=group_schema['pydantic_model'],
+                    )
                 
-                schema_response = []
-                prompt_with_schema = deepcopy(prompt)
-                merged_dict = deepcopy(schema)
-                merged_dict.update(item)
-                prompt_with_schema.replace_placeholders(merged_dict)
+                parsed_response = prompt.schemas.parse_group_response(response, group)
+                for schema_idx in group:
+                    group_responses[schema_idx].append(parsed_response.get(schema_idx, "ERROR"))
+        except Exception as e:
+            print(f"Error processing schema group {[schema['variable_name'] for schema in schemas]} for item {index}: {e}")
+            group_responses = {schema_idx: ["ERROR"] for schema_idx in group}
+        
+        item_responses = {}
+        for schema_idx, schema in zip(group, schemas):
+            schema_response = group_responses[schema_idx]
+            if "ERROR" in schema_response:
+                print(f"Error processing schema {schema['variable_name']} for item {index}: missing from the group response")
+                # Failed schemas do not satisfy any dependency condition
+                previous_responses[f"{schema['variable_name']}_response"] = ""
+                item_responses[schema_idx] = [{f"{schema['variable_name']}_response": "ERROR"}]
+            elif len(schema_response) == 1:
+                response_key = f"{schema['variable_name']}_response"
+                previous_responses[response_key] = schema_response[0]
+                item_responses[schema_idx] = [{response_key: schema_response[0]}]
+            else:
+                item_responses[schema_idx] = []
+                for r, schema_response_ in enumerate(schema_response):
+                    response_key = f"{schema['variable_name']}_response_{r}"
+                    previous_responses[response_key] = schema_response_
+                    item_responses[schema_idx].append({response_key: schema_response_})
+        
+        return item_responses, messages
+    
+    async def _aprocess_schema(self, prompt, schema_idx, item, index, messages, previous_responses):
+        schema = prompt.schemas.schemas[schema_idx]
+        item_response = []
+        try:
+            # Check if this schema should be processed based on dependencies
+            should_process, default_value = prompt.schemas.should_process_schema(schema_idx, previous_responses)
+            
+            if not should_process:
+                # Use default value for skipped schema
+                response_key = f"{schema['variable_name']}_response"
+                previous_responses[response_key] = default_value
+                item_response.append({response_key: default_value})
+                if self.option_scoring and schema['type'] == "select":
+                    item_response.append({f"{schema['variable_name']}_probability": None})
+                return item_response, messages
+            
+            schema_response = []
+            schema_probabilities = []
+            user_prompts, response_templates = self._render_prompts(prompt, schema, item)
+            
+            additional_generation_params = {}
+            
+            # Get response format if using Pydantic
+            response_format = None
+            if self.use_pydantic and schema.get('pydantic_model'):
+                response_format = prompt.schemas.get_pydantic_model(schema_idx)
+                            
+            for i in range(prompt.num_turns):
+                messages.append({"role": "user", "content": user_prompts[i]})
+                if prompt.response_templates[i] != "":
+                    messages.append({"role": "assistant", "content": response_templates[i]})
                 
-                additional_generation_params = {}
+                if self.option_scoring and schema['type'] == "select":
+                    # Pick the most likely option instead of generating an answer
+                    with self.telemetry.track(schema['variable_name'], i, index):
+                        option, probability, messages = await self._ascore_options(prompt, schema, i, messages)
+                    schema_response.append(option)
+                    schema_probabilities.append(probability)
+                    continue
                 
-                # Get response format if using Pydantic
-                response_format = None
-                if self.use_pydantic and schema.get('pydantic_model'):
-                    response_format = prompt.schemas.get_pydantic_model(schema_idx)
-                                
-                for i in range(prompt.num_turns):
-                    messages.append({"role": "user", "content": prompt_with_schema.user_prompts[i]})
-                    if prompt.response_templates[i] != "":
-                        messages.append({"role": "assistant", "content": prompt_with_schema.response_templates[i]})
-                    
-                    response, messages = self.client.ask_model(
+                with self.telemetry.track(schema['variable_name'], i, index):
+                    response, messages = await self.client.aask_model(
                         messages, 
-                        prompt_with_schema.stop_tags[i], 
+                        prompt.stop_tags[i], 
                         max_tokens=self.max_generation_tokens, 
                         response_format=response_format,
                         **additional_generation_params
                     )
-                    
-                    # Parse the response if using Pydantic
-                    parsed_response = self.prompt.schemas.parse_response(response, schema_idx)
-                    schema_response.append(parsed_response)
-                                                                                        
-                if len(schema_response) == 1:
-                    response_key = f"{schema['variable_name']}_response"
-                    response_value = schema_response[0]
-                    previous_responses[response_key] = response_value
-                    item_response.append({response_key: response_value})
-                else:
-                    for r, schema_response_ in enumerate(schema_response):    
-                        response_key = f"{schema['variable_name']}_response_{r}"
-                        previous_responses[response_key] = schema_response_
-                        item_response.append({response_key: schema_response_})
-                            
-                if self.hide_blocks:
-                    messages = [
-                        {"role": "system", "content": prompt.system_prompt},
-                    ]
-            except Exception as e:
-                print(f"Error processing schema {schema['variable_name']} for item {index}: {e}")
-                # Add empty response for failed schema to maintain consistency
+                
+                # Parse the response if using Pydantic
+                parsed_response = self.prompt.schemas.parse_response(response, schema_idx)
+                schema_response.append(parsed_response)
+                                                                                    
+            if len(schema_response) == 1:
                 response_key = f"{schema['variable_name']}_response"
-                previous_responses[response_key] = ""
-                item_response.append({response_key: "ERROR"})
+                response_value = schema_response[0]
+                previous_responses[response_key] = response_value
+                item_response.append({response_key: response_value})
+                if schema_probabilities:
+                    item_response.append({f"{schema['variable_name']}_probability": schema_probabilities[0]})
+            else:
+                for r, schema_response_ in enumerate(schema_response):    
+                    response_key = f"{schema['variable_name']}_response_{r}"
+                    previous_responses[response_key] = schema_response_
+                    item_response.append({response_key: schema_response_})
+                    if schema_probabilities:
+                        item_response.append({f"{schema['variable_name']}_probability_{r}": schema_probabilities[r]})
+                        
+            if self.hide_blocks:
+                messages = [
+                    {"role": "system", "content": prompt.system_prompt},
+                ]
+        except Exception as e:
+            print(f"Error processing schema {schema['variable_name']} for item {index}: {e}")
+            # Add empty response for failed schema to maintain consistency
+            response_key = f"{schema['variable_name']}_response"
+            previous_responses[response_key] = ""
+            item_response.append({response_key: "ERROR"})
+            if self.option_scoring and schema['type'] == "select":
+                item_response.append({f"{schema['variable_name']}_probability": None})
         
-        return index, item_response
+        return item_response, messages
 
+    async def _ascore_options(self, prompt, schema, turn, messages):
+        """
+        Score the options of a select schema as continuations of the conversation.
+        
+        Returns:
+            tuple: (chosen option, its probability among the options, updated messages)
+        """
+        stop = prompt.stop_tags[turn] if isinstance(prompt.stop_tags[turn], str) else ""
+        if self.use_pydantic:
+            # Score the whole structured answer, as it would have been generated
+            candidates = [json.dumps({schema['variable_name']: option}) for option in schema['options']]
+        else:
+            candidates = [option + stop for option in schema['options']]
+        best, probabilities, messages = await self.client.aask_options(messages, candidates)
+        return schema['options'][best], round(probabilities[best], 6), messages
+    
+    def _render_prompts(self, prompt, schema, item):
+        user_prompts, response_templates = prompt.render(schema, item)
+        if self.prefix_caching:
+            # Keep the system prompt and the item-only start of the first turn as a stable prefix
+            prefix, tail = prompt.render_shared_prefix(prompt.user_prompts[0], schema, item)
+            user_prompts[0] = self.client.build_user_content(prefix, tail)
+        return user_prompts, response_templates
+    
+    def _check_shared_prefix(self):
+        schema_placeholders = self.prompt.get_schema_placeholders()
+        for literal, name in self.prompt.get_compiled_template(self.prompt.user_prompts[0]):
+            if name in schema_placeholders:
+                warnings.warn(
+                    f"The first user prompt reaches the schema-specific placeholder {{{{{name}}}}} before any item placeholder, "
+                    "so nothing item-specific is shared between schema requests. Move placeholders such as {{report}} "
+                    "before schema placeholders to benefit from prefix caching."
+                )
+                return
+            if name is not None:
+                return
+    
     def __call__(self, items):
-        if not isinstance(items, list):
-            items = [items]
+        return _run_sync(self.acall(items))
 
+    async def acall(self, items):
         self.log['Start Time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
-            futures = []
-            for index, item in enumerate(items):
-                future = executor.submit(self.process_single_item, item, index)
-                futures.append(future)
+        start = time.perf_counter()
+        self.telemetry.reset()
+        cache_stats_start = self.cache.stats() if self.cache is not None else None
+        usage_start = dict(self.client.usage)
+        controller_stats_start = dict(getattr(getattr(self.client, "concurrency_controller", None), "stats", {}))
+        retry_stats_start = dict(getattr(getattr(self.client, "retry_policy", None), "stats", {}))
+        # Each item holds one slot of the semaphore while its schemas are being processed
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.stats = {"queued": 0, "in_flight": 0, "completed": 0}
+        if self.ordered_output:
+            self.stats["buffered"] = 0
+
+        async def bounded_process(item, index):
+            async with semaphore:
+                self.stats["queued"] -= 1
+                self.stats["in_flight"] += 1
+                try:
+                    return await self.aprocess_single_item(item, index)
+                finally:
+                    self.stats["in_flight"] -= 1
 
-            if self.output_file is not None:
-                with open(self.output_file, "w", newline="") as f:
-                    writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-                    header_written = False
+        # Rows go to a working file that replaces `output_file` once the run has completed
+        sink = self.sink_class(self.output_file) if self.output_file is not None else None
+        completed, offset = set(), 0
+        if self.resume and sink is not None:
+            completed, offset = self._prepare_resume(sink)
 
-                    for i, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Processing items")):
-                        index, result = future.result()
-                        result.insert(0, {"index": index})
-                        result_keys = [list(r.keys())[0] for r in result]
-                        for key, value in items[index].items():
-                            if key not in result_keys:
-                                result.append({key: value})
+        # Items are pulled lazily: at most `max_queued_items` items wait for a free slot at any time,
+        # new ones are admitted only after a finished item has been written out
+        window = self.concurrency + self.max_queued_items
+        item_iterator = enumerate(iter_items(items))
+        # The number of items of a shard is only known once the input has been read
+        total = count_items(items) if self.num_shards is None else None
+        pending = {}
+        number_of_items = 0
+        # In ordered mode, finished rows wait in the reorder buffer until every earlier item is written
+        admitted = deque()
+        reorder_buffer = {}
+        # Duplicates wait for the result of the first item of their kind instead of being processed again
+        deduplicator = Deduplicator(self.prompt.get_placeholders(), self.near_duplicate_threshold, max_items=self.dedup_cache_size) if self.deduplicate else None
+        duplicates = {}
+        # Representative of every item in flight, and (index, result) of the most recent unique items
+        representatives = {}
+        results = OrderedDict()
+        waiting_duplicates = 0
+
+        def fill_window():
+            nonlocal number_of_items, waiting_duplicates
+            if self.ordered_output and len(reorder_buffer) >= self.max_reorder_buffer:
+                # The buffer is full: stop admitting items until the head-of-line item completes
+                return
+            for index, item in item_iterator:
+                if index in completed:
+                    continue
+                if self.num_shards is not None and shard_of(item, self.num_shards, self.shard_key) != self.shard_index:
+                    continue
+                number_of_items += 1
+                if self.ordered_output:
+                    admitted.append(index)
+                if deduplicator is not None:
+                    representative = deduplicator.register(item, index)
+                    if representative in results:
+                        results.move_to_end(representative)
+                        source, result = results[representative]
+                        finish(index, item, result, source)
+                        if self.ordered_output and len(reorder_buffer) >= self.max_reorder_buffer:
+                            break
+                        continue
+                    if representative in duplicates:
+                        duplicates[representative].append((index, item))
+                        waiting_duplicates += 1
+                        # Waiting duplicates hold a place in the window, which bounds the items read ahead
+                        if len(pending) + waiting_duplicates >= window:
+                            break
+                        continue
+                    # First of its kind, or its result has been dropped from `results`: process it again
+                    duplicates[representative] = []
+                    representatives[index] = representative
+                pending[asyncio.ensure_future(bounded_process(item, index))] = item
+                self.stats["queued"] += 1
+                if len(pending) + waiting_duplicates >= window:
+                    break
+        
+        def emit(index, row):
+            if writer is not None:
+                writer.put(index, row)
+        
+        def finish(index, item, result, duplicate_of=None):
+            row = self._build_row(index, result, item)
+            if deduplicator is not None:
+                row["duplicate_of"] = duplicate_of
+            if self.ordered_output:
+                reorder_buffer[index] = row
+                while admitted and admitted[0] in reorder_buffer:
+                    head = admitted.popleft()
+                    emit(head, reorder_buffer.pop(head))
+            else:
+                emit(index, row)
+            self.stats["completed"] += 1
+            progress.update(1)
 
-                        if not header_written:
-                            # Write header only if it hasn't been written yet
-                            header = [key for r in result for key in r.keys()]
-                            writer.writerow(header)
-                            header_written = True
+        checkpoint = None
+        writer = None
+        progress = tqdm(total=total - len(completed) if total is not None else None, desc="Processing items")
+        try:
+            if sink is not None:
+                if self.sink_class.supports_resume:
+                    checkpoint = Checkpoint(self.output_file, self.prompt.md5_hash, interval=self.checkpoint_interval)
+                    checkpoint.start(offset, completed)
+                # The metadata known so far (prompt hash, model, ...) is recorded right away for resuming
+                sink.open(offset, metadata=self.log)
+                # Rows are handed to a writer thread, so that disk I/O does not delay the scheduling of new items
+                writer = SinkWriter(sink, checkpoint, batch_size=self.write_batch_size, flush_interval=self.write_interval)
+                writer.start()
 
-                        row = []
-                        for r in result:
-                            key = list(r.keys())[0]
-                            value = r[key]
-                            if isinstance(value, list):
-                                value = "|".join(str(v) for v in value)
-                            row.append(value)
-                        writer.writerow(row)
+            fill_window()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    item = pending.pop(task)
+                    index, result = task.result()
+                    finish(index, item, result)
+                    if deduplicator is not None:
+                        representative = representatives.pop(index)
+                        for duplicate_index, duplicate_item in duplicates.pop(representative):
+                            finish(duplicate_index, duplicate_item, result, index)
+                            waiting_duplicates -= 1
+                        # Later duplicates reuse the result right away while it is among the most recent ones
+                        results[representative] = (index, result)
+                        if self.dedup_cache_size is not None and len(results) > self.dedup_cache_size:
+                            results.popitem(last=False)
+                if self.ordered_output:
+                    self.stats["buffered"] = len(reorder_buffer)
+                fill_window()
+                progress.set_postfix(self.stats, refresh=False)
+        finally:
+            progress.close()
+            for task in pending:
+                task.cancel()
+            if writer is not None:
+                writer.close()
+            if checkpoint is not None:
+                checkpoint.close()
+            self.telemetry.close()
 
         self.log['End Time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.log['Duration'] = (datetime.strptime(self.log['End Time'], '%Y-%m-%d %H:%M:%S') - 
-                                datetime.strptime(self.log['Start Time'], '%Y-%m-%d %H:%M:%S')).total_seconds()
-        self.log['Number of Items'] = len(items)
-        self.log['Average Processing Time'] = self.log['Duration'] / self.log['Number of Items']
-        
-        # Add log metadata as comments at the beginning of the CSV file
-        if self.output_file is not None:
-            self._add_metadata_to_csv()
+        self.log['Duration'] = round(time.perf_counter() - start, 3)
+        self.log['Number of Items'] = number_of_items
+        self.log['Average Processing Time'] = round(self.log['Duration'] / max(self.log['Number of Items'], 1), 6)
+        if self.resume:
+            self.log['Resumed Items'] = len(completed)
+        if deduplicator is not None:
+            self.log.update(deduplicator.log_entries())
+        prompt_tokens = self.client.usage['prompt_tokens'] - usage_start['prompt_tokens']
+        if prompt_tokens > 0:
+            cached_tokens = self.client.usage['cached_tokens'] - usage_start['cached_tokens']
+            self.log['Prompt Tokens'] = prompt_tokens
+            self.log['Completion Tokens'] = self.client.usage['completion_tokens'] - usage_start['completion_tokens']
+            self.log['Cached Prompt Tokens'] = cached_tokens
+            self.log['Prompt Cache Hit Rate'] = round(cached_tokens / prompt_tokens, 4)
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            self.log['Cache Hits'] = cache_stats['hits'] - cache_stats_start['hits']
+            self.log['Cache Misses'] = cache_stats['misses'] - cache_stats_start['misses']
+            self.log['Cache Bytes Read'] = cache_stats['bytes_read'] - cache_stats_start['bytes_read']
+            self.log['Cache Bytes Written'] = cache_stats['bytes_written'] - cache_stats_start['bytes_written']
+        self.log.update(self.telemetry.log_entries())
+        controller = getattr(self.client, "concurrency_controller", None)
+        if controller is not None:
+            self.log['Final Concurrency Limit'] = int(controller.limit)
+            self.log['Rate-Limited Requests'] = controller.stats['overloads'] - controller_stats_start['overloads']
+        retry_policy = getattr(self.client, "retry_policy", None)
+        if retry_policy is not None:
+            self.log['Retries'] = retry_policy.stats['retries'] - retry_stats_start['retries']
+            self.log['Hedged Requests'] = retry_policy.stats['hedges'] - retry_stats_start['hedges']
+            self.log['Hedge Wins'] = retry_policy.stats['hedge_wins'] - retry_stats_start['hedge_wins']
+            self.log['Deadlines Exceeded'] = retry_policy.stats['deadline_exceeded'] - retry_stats_start['deadline_exceeded']
+        
+        # Record the log as the run metadata of the output
+        if sink is not None:
+            sink.finalize(self.log)
+            if checkpoint is not None:
+                # The run is complete, the output file itself now records every finished item
+                checkpoint.close(remove=True)
+    
+    def _build_row(self, index, result, item):
+        row = {"index": index}
+        for r in result:
+            row.update(r)
+        for key, value in item.items():
+            if key not in row:
+                row[key] = value
+        return row
     
     def save_log(self, log_dir="./RadPrompter.log"):
         with open(log_dir, "w") as f:
@@ -206,12 +640,36 @@ class RadPrompter():
             
             f.close()
             
-    def _add_metadata_to_csv(self):
-        with open(self.output_file, "r") as f:
-            original_lines = f.readlines()
+    def _prepare_resume(self, sink):
+        """
+        Find the items already written by a previous run and truncate any partially written row.
         
-        with open(self.output_file, "w") as f:
-            for key, value in self.log.items():
-                f.write(f"#{key}: {value}\n")
-
-            f.writelines(original_lines)
\ No newline at end of file
+        Args:
+            sink (OutputSink): Sink of the run, whose working file is resumed
+        
+        Returns:
+            tuple: (completed: set of item indices, offset: byte offset to resume appending from)
+        """
+        # An interrupted run left a working file, a finished run (resumed with new items) the output itself
+        path = sink.working_path if os.path.isfile(sink.working_path) else self.output_file
+        checkpoint = Checkpoint(self.output_file, self.prompt.md5_hash).load()
+        if checkpoint is not None and os.path.isfile(path):
+            prompt_hash, completed, offset = checkpoint["prompt_hash"], checkpoint["completed"], checkpoint["offset"]
+        elif os.path.isfile(path):
+            metadata, completed, offset = self.sink_class.scan(path)
+            prompt_hash = metadata.get("Prompt Hash")
+        else:
+            return set(), 0
+        
+        if prompt_hash is None:
+            warnings.warn(f"Could not find the prompt hash of {self.output_file}. Resuming without verifying that the prompt is unchanged.")
+        elif prompt_hash != self.prompt.md5_hash:
+            raise ValueError(f"Output file {self.output_file} was created with a different prompt (hash {prompt_hash}). Use a new output file or pass `resume=False`.")
+        
+        if path != sink.working_path:
+            os.replace(path, sink.working_path)
+        if os.path.getsize(sink.working_path) > offset:
+            with open(sink.working_path, "r+b") as f:
+                f.truncate(offset)
+        
+        return completed, offset
@@ -0,0 +1,146 @@
+import os
+import re
+import glob
+import json
+import heapq
+import hashlib
+from .sinks import get_sink_class
+
+# Metadata that has to be identical in every part of a sharded run
+SHARED_METADATA_KEYS = [
+    "RadPrompter Version",
+    "Model",
+    "Seed",
+    "Temperature",
+    "Frequency Penalty",
+    "Top-P",
+    "Prompt Version",
+    "Prompt Hash",
+    "Use Pydantic",
+    "Schema Groups",
+]
+
+
+def shard_of(item, num_shards, shard_key=None):
+    """
+    Return the shard of an item, from a hash that is stable across processes, machines and runs.
+
+    Args:
+        item (dict): The item
+        num_shards (int): Number of shards
+        shard_key (str): Field of the item to hash (e.g. an accession number). The whole item is hashed if None.
+    """
+    value = item[shard_key] if shard_key is not None else item
+    serialized = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    digest = hashlib.md5(serialized.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def get_part_file(output_file, shard_index, num_shards):
+    """Return the part file written by shard `shard_index`, e.g. `output.part-00002-of-00008.csv`."""
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}.part-{shard_index:05d}-of-{num_shards:05d}{extension}"
+
+
+def find_part_files(output_file):
+    """
+    Find the part files of a sharded run.
+
+    Returns:
+        list: Part files ordered by shard index
+
+    Raises:
+        ValueError: If there are no parts, parts of runs with different shard counts, or missing parts
+    """
+    stem, extension = os.path.splitext(output_file)
+    pattern = re.compile(re.escape(stem) + r"\.part-(\d{5})-of-(\d{5})" + re.escape(extension) + "$")
+    parts = {}
+    for path in glob.glob(glob.escape(stem) + ".part-*-of-*" + glob.escape(extension)):
+        match = pattern.match(path)
+        if match:
+            parts[(int(match.group(1)), int(match.group(2)))] = path
+
+    if not parts:
+        raise ValueError(f"No part files found for {output_file}")
+    shard_counts = {num_shards for _, num_shards in parts}
+    if len(shard_counts) > 1:
+        raise ValueError(f"Part files of {output_file} come from runs with different numbers of shards: {sorted(shard_counts)}")
+    num_shards = shard_counts.pop()
+    missing = [shard_index for shard_index in range(num_shards) if (shard_index, num_shards) not in parts]
+    if missing:
+        raise ValueError(f"Missing part files for shards {missing} of {output_file}. Have all shards finished?")
+    return [parts[(shard_index, num_shards)] for shard_index in range(num_shards)]
+
+
+def merge_shards(output_file, part_files=None, remove_parts=False):
+    """
+    Merge the part files of a sharded run into a single output file.
+
+    The parts must share the prompt hash and the settings in `SHARED_METADATA_KEYS`. If every part
+    was written with `ordered_output=True`, the merged rows are in input order; otherwise parts are
+    concatenated in shard order. Rows are streamed, so the parts do not have to fit in memory.
+
+    Args:
+        output_file (str): Path of the merged output. Its extension selects the output format.
+        part_files (list): Part files to merge. Found next to `output_file` if None.
+        remove_parts (bool): Delete the part files (and their metadata sidecars) after merging
+
+    Returns:
+        dict: Metadata of the merged output
+    """
+    part_files = part_files or find_part_files(output_file)
+
+    metadata = []
+    for path in part_files:
+        if not os.path.isfile(path):
+            raise ValueError(f"Part file {path} does not exist or has not finished (look for {path}.partial)")
+        metadata.append(get_sink_class(path).read_metadata(path))
+
+    for key in SHARED_METADATA_KEYS:
+        values = {str(part_metadata.get(key)) for part_metadata in metadata}
+        if len(values) > 1:
+            raise ValueError(f"Part files disagree on {key!r}: {sorted(values)}. They were not produced by the same run configuration.")
+    if not metadata[0].get("Prompt Hash"):
+        raise ValueError("Part files do not record a prompt hash, cannot check that they belong to the same run.")
+
+    merged_metadata = {key: metadata[0][key] for key in SHARED_METADATA_KEYS if key in metadata[0]}
+    merged_metadata["Merged Parts"] = len(part_files)
+    merged_metadata["Start Time"] = min(str(part_metadata.get("Start Time", "")) for part_metadata in metadata)
+    merged_metadata["End Time"] = max(str(part_metadata.get("End Time", "")) for part_metadata in metadata)
+    for key in ["Number of Items", "Requests", "Failed Requests", "Prompt Tokens", "Completion Tokens", "Cached Prompt Tokens"]:
+        values = [part_metadata.get(key) for part_metadata in metadata]
+        if all(value is not None for value in values):
+            merged_metadata[key] = sum(int(value) for value in values)
+    costs = [part_metadata.get("Estimated Cost (USD)") for part_metadata in metadata]
+    if all(cost is not None for cost in costs):
+        merged_metadata["Estimated Cost (USD)"] = round(sum(float(cost) for cost in costs), 6)
+
+    readers = [get_sink_class(path).read_rows(path) for path in part_files]
+    ordered = all(str(part_metadata.get("Ordered Output")) == "True" for part_metadata in metadata)
+    if ordered:
+        rows = heapq.merge(*readers, key=lambda row: int(row["index"]))
+    else:
+        rows = (row for reader in readers for row in reader)
+
+    sink = get_sink_class(output_file)(output_file)
+    sink.open(0, metadata=merged_metadata)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= 1000:
+                sink.write_rows(batch)
+                batch = []
+        if batch:
+            sink.write_rows(batch)
+    except BaseException:
+        sink.close()
+        raise
+    sink.finalize(merged_metadata)
+
+    if remove_parts:
+        for path in part_files:
+            for sidecar in [path, path + ".meta.json"]:
+                if os.path.isfile(sidecar):
+                    os.remove(sidecar)
+    return merged_metadata
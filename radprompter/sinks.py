@@ -0,0 +1,497 @@
+import os
+import csv
+import json
+import time
+import queue
+import threading
+from .checkpoint import scan_output_file
+try:
+    import pyarrow as pa # type: ignore
+    import pyarrow.parquet as pq # type: ignore
+    os.environ['HAS_PYARROW'] = str(True)
+except ImportError:
+    os.environ['HAS_PYARROW'] = str(False)
+
+
+# Bytes reserved at the start of a CSV output for the `#key: value` metadata lines
+HEADER_BLOCK_SIZE = 8192
+
+
+def write_manifest(path, metadata):
+    """Atomically write the run metadata to a JSON sidecar."""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read_manifest(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class OutputSink:
+    """
+    Destination of the engine's result rows.
+
+    A row is a dictionary of column name to value, starting with the item `index`, followed by
+    the `<variable>_response` columns and the item's own fields. Sinks that can be appended to
+    after a crash set `supports_resume` and implement `scan`.
+
+    Rows are written to `working_path` (`<path>.partial`), which is only renamed to `path` once
+    the run has finished and its metadata has been recorded, so `path` always holds a complete run.
+    """
+    supports_resume = False
+
+    def __init__(self, path):
+        self.path = path
+        self.working_path = path + ".partial"
+        self.manifest_path = path + ".meta.json"
+
+    def open(self, offset=0, metadata=None):
+        """
+        Open the working file.
+
+        Args:
+            offset (int): Byte offset to append from when resuming, 0 to start a new file
+            metadata (dict): Metadata known at the start of the run
+        """
+        raise NotImplementedError()
+
+    def write_rows(self, rows):
+        raise NotImplementedError()
+
+    def sync(self):
+        """Make the rows written so far durable and return the file offset they end at."""
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def finalize(self, metadata):
+        """Close the sink after a complete run, record the run metadata and publish the output file."""
+        self.close()
+        write_manifest(self.manifest_path, metadata)
+        self._publish()
+
+    @classmethod
+    def scan(cls, path):
+        """
+        Read an existing output file.
+
+        Returns:
+            tuple: (metadata: dict, completed: set of item indices, offset: byte offset right after the last complete row)
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def read_metadata(cls, path):
+        """Return the run metadata of a finished output file."""
+        return read_manifest(path + ".meta.json")
+
+    @classmethod
+    def read_rows(cls, path):
+        """Iterate over the rows of a finished output file as dictionaries."""
+        raise NotImplementedError()
+
+    def _publish(self):
+        # The rename is atomic, readers see either the previous output or the complete new one
+        os.replace(self.working_path, self.path)
+        try:
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(directory)
+        except OSError:
+            pass
+        finally:
+            os.close(directory)
+
+
+class CSVSink(OutputSink):
+    """
+    CSV output with every field quoted and list values joined with "|".
+
+    The run metadata is stored as `#key: value` lines in a block reserved at the start of the file
+    and padded with a blank `#` line, so it is filled in place at the end of the run without
+    rewriting the rows. Readers that skip `#` lines (e.g. `pd.read_csv(..., comment="#")`) are
+    unaffected. Metadata that does not fit the block is completed in the `<path>.meta.json` sidecar.
+    """
+    supports_resume = True
+    _file = None
+
+    def open(self, offset=0, metadata=None):
+        if offset > 0:
+            self._block_size = self._get_header_block_size()
+            self._file = open(self.working_path, "a", newline="")
+        else:
+            initial_block = self._render_metadata(metadata or {})
+            self._block_size = max(HEADER_BLOCK_SIZE, 2 * len(initial_block))
+            self._file = open(self.working_path, "w", newline="")
+            self._file.write(self._render_block(metadata or {}).decode("utf-8"))
+        self._writer = csv.writer(self._file, quoting=csv.QUOTE_ALL)
+        self._header_written = offset > self._block_size
+
+    def write_rows(self, rows):
+        for row in rows:
+            if not self._header_written:
+                self._writer.writerow(row.keys())
+                self._header_written = True
+            self._writer.writerow(["|".join(str(v) for v in value) if isinstance(value, list) else value for value in row.values()])
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finalize(self, metadata):
+        self.close()
+        block = self._render_block(metadata)
+        if len(self._render_metadata(metadata)) > self._block_size:
+            write_manifest(self.manifest_path, metadata)
+        elif os.path.isfile(self.manifest_path):
+            # Left over from a previous run whose metadata did not fit
+            os.remove(self.manifest_path)
+
+        # Only the reserved block is overwritten, the rows stay where they are
+        with open(self.working_path, "r+b") as f:
+            if block is not None:
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        self._publish()
+
+    @classmethod
+    def scan(cls, path):
+        metadata, completed, offset = scan_output_file(path)
+        manifest_path = (path[:-len(".partial")] if path.endswith(".partial") else path) + ".meta.json"
+        if "Prompt Hash" not in metadata:
+            metadata = {**read_manifest(manifest_path), **metadata}
+        return metadata, completed, offset
+
+    @classmethod
+    def read_metadata(cls, path):
+        metadata = {}
+        with open(path, "r", newline="") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    break
+                key, _, value = line[1:].partition(":")
+                if key.strip():
+                    metadata[key.strip()] = value.strip()
+        if "Metadata" in metadata:
+            # The block overflowed, the sidecar holds the complete metadata
+            metadata = {**metadata, **read_manifest(path + ".meta.json")}
+            metadata.pop("Metadata")
+        return metadata
+
+    @classmethod
+    def read_rows(cls, path):
+        with open(path, "r", newline="") as f:
+            # Only the leading block holds metadata; later lines starting with "#" belong to quoted multiline fields
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line.startswith("#"):
+                    break
+            f.seek(position)
+            yield from csv.DictReader(f)
+
+    @staticmethod
+    def _render_metadata(metadata):
+        return "".join(f"#{key}: {str(value).replace(chr(10), ' ')}\n" for key, value in metadata.items()).encode("utf-8")
+
+    def _render_block(self, metadata):
+        """Render the metadata lines padded to exactly the reserved block size, or None if the block is too small to be used."""
+        block = self._render_metadata(metadata)
+        if len(block) > self._block_size:
+            # Keep the lines that fit and point to the sidecar for the complete metadata
+            overflow = f"#Metadata: {os.path.basename(self.manifest_path)}\n".encode("utf-8")
+            if len(overflow) > self._block_size - 2:
+                return None
+            lines = []
+            size = len(overflow)
+            for key, value in metadata.items():
+                line = self._render_metadata({key: value})
+                if size + len(line) > self._block_size - 2:
+                    break
+                lines.append(line)
+                size += len(line)
+            block = b"".join(lines) + overflow
+
+        padding = self._block_size - len(block)
+        if padding == 1:
+            # A padding line needs at least "#\n", widen the last metadata line instead
+            return block[:-1] + b" \n"
+        if padding >= 2:
+            block += b"#" + b" " * (padding - 2) + b"\n"
+        return block
+
+    def _get_header_block_size(self):
+        # Files written before the block was reserved use their existing metadata lines as the block
+        size = 0
+        with open(self.working_path, "rb") as f:
+            for line in f:
+                if not line.startswith(b"#"):
+                    break
+                size += len(line)
+        return size
+
+
+class JSONLSink(OutputSink):
+    """JSON Lines output that keeps lists and numbers typed. The run metadata goes to a `<path>.meta.json` sidecar."""
+    supports_resume = True
+    _file = None
+
+    def open(self, offset=0, metadata=None):
+        self._file = open(self.working_path, "a" if offset > 0 else "w", encoding="utf-8")
+
+    def write_rows(self, rows):
+        self._file.write("".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows))
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @classmethod
+    def scan(cls, path):
+        manifest_path = (path[:-len(".partial")] if path.endswith(".partial") else path) + ".meta.json"
+        metadata = read_manifest(manifest_path)
+
+        completed = set()
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                # A line cut short by a crash is missing its newline or does not parse
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    completed.add(int(json.loads(line)["index"]))
+                except (ValueError, KeyError, TypeError):
+                    break
+                offset += len(line)
+        return metadata, completed, offset
+
+    @classmethod
+    def read_rows(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class ParquetSink(OutputSink):
+    """
+    Parquet output written incrementally, one row group per `row_group_size` rows.
+
+    Column types are inferred from the first row group; later values that do not fit the inferred
+    type (e.g. "ERROR" in a numeric column) are stored as nulls. The run metadata is stored in the
+    file's key-value metadata; a run without rows writes a file without columns that still holds it.
+    Parquet files cannot be appended to, so runs cannot be resumed.
+    """
+
+    def __init__(self, path, row_group_size=10000):
+        if os.environ['HAS_PYARROW'] != "True":
+            raise ImportError("Parquet output requires the `pyarrow` package to be installed.")
+        super().__init__(path)
+        self.row_group_size = row_group_size
+        self._writer = None
+        self._buffer = []
+
+    def open(self, offset=0, metadata=None):
+        assert offset == 0, "Parquet output cannot be appended to"
+        self._writer = None
+        self._buffer = []
+
+    def write_rows(self, rows):
+        self._buffer.extend(rows)
+        while len(self._buffer) >= self.row_group_size:
+            self._write_row_group(self._buffer[:self.row_group_size])
+            self._buffer = self._buffer[self.row_group_size:]
+
+    def sync(self):
+        return 0
+
+    def close(self, metadata=None):
+        if self._buffer:
+            self._write_row_group(self._buffer)
+            self._buffer = []
+        if self._writer is None:
+            if metadata is None:
+                return
+            # A run without rows (e.g. an empty shard) still publishes a file holding its metadata
+            self._writer = pq.ParquetWriter(self.working_path, pa.schema([]))
+        if metadata:
+            self._writer.add_key_value_metadata({str(key): str(value) for key, value in metadata.items()})
+        self._writer.close()
+        self._writer = None
+
+    def finalize(self, metadata):
+        self.close(metadata)
+        if os.path.isfile(self.working_path):
+            self._publish()
+
+    @classmethod
+    def read_metadata(cls, path):
+        metadata = pq.read_metadata(path).metadata or {}
+        # Skip the Arrow schema stored by pyarrow alongside the run metadata
+        return {key.decode(): value.decode() for key, value in metadata.items() if key != b"ARROW:schema"}
+
+    @classmethod
+    def read_rows(cls, path):
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+
+    def _write_row_group(self, rows):
+        columns = list(rows[0].keys()) if self._writer is None else self._writer.schema_arrow.names
+        if self._writer is None:
+            arrays = [self._to_array([row.get(column) for row in rows]) for column in columns]
+            schema = pa.schema([pa.field(column, array.type) for column, array in zip(columns, arrays)])
+            self._writer = pq.ParquetWriter(self.working_path, schema)
+        else:
+            schema = self._writer.schema_arrow
+            arrays = [self._to_array([row.get(column) for row in rows], field.type) for column, field in zip(columns, schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    @staticmethod
+    def _to_array(values, type=None):
+        try:
+            array = pa.array(values, type=type)
+            # A column with only nulls so far can hold anything later on
+            return array.cast(pa.string()) if type is None and pa.types.is_null(array.type) else array
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+            pass
+
+        if type is None:
+            # Mixed types (e.g. numbers and "ERROR"): infer from the values that parse, or fall back to strings
+            valid = [value for value in values if not isinstance(value, str)]
+            try:
+                type = pa.array(valid).type if valid else pa.string()
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+                type = pa.string()
+            if pa.types.is_null(type):
+                type = pa.string()
+
+        if pa.types.is_string(type):
+            return pa.array([None if value is None else json.dumps(value, default=str) if isinstance(value, (list, dict)) else str(value) for value in values], type=type)
+
+        converted = []
+        for value in values:
+            try:
+                pa.array([value], type=type)
+                converted.append(value)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+                converted.append(None)
+        return pa.array(converted, type=type)
+
+
+SINKS = {
+    "csv": CSVSink,
+    "jsonl": JSONLSink,
+    "parquet": ParquetSink,
+}
+
+
+def get_sink_class(output_file, output_format=None):
+    """
+    Return the sink class of an output file.
+
+    Args:
+        output_file (str): Path of the output file
+        output_format (str or type): Key of `SINKS` or an `OutputSink` subclass. Inferred from the
+            extension of `output_file` if None.
+    """
+    if isinstance(output_format, type) and issubclass(output_format, OutputSink):
+        return output_format
+    if output_format is None:
+        output_format = os.path.splitext(output_file)[1].lstrip(".").lower()
+    if output_format not in SINKS:
+        raise ValueError(f"Unsupported output format: {output_format!r}. Use one of {list(SINKS)} or pass an `OutputSink` subclass.")
+    return SINKS[output_format]
+
+
+class SinkWriter:
+    """
+    Background thread that writes rows to a sink, so that disk I/O does not hold up the event loop.
+
+    Rows are batched and written once `batch_size` rows are waiting or `flush_interval` seconds
+    have passed since the first of them arrived. After every batch, the written indices are
+    recorded in the checkpoint (if any), which makes them durable every `checkpoint.interval` seconds,
+    also when no new rows arrive.
+    """
+
+    _STOP = object()
+
+    def __init__(self, sink, checkpoint=None, batch_size=256, flush_interval=1.0):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="radprompter-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, index, row):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((index, row))
+
+    def close(self):
+        """Write the remaining rows, make everything durable and stop the thread."""
+        self._queue.put(self._STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                if deadline is not None:
+                    timeout = max(deadline - time.monotonic(), 0)
+                else:
+                    # While no rows arrive (e.g. requests stall), rows already written are still made durable on time
+                    timeout = self.checkpoint.time_until_flush() if self.checkpoint is not None else None
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is self._STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if self._error is not None:
+                # Keep draining so that producers never block, but stop writing
+                continue
+            try:
+                if batch:
+                    self.sink.write_rows([row for _, row in batch])
+                if self.checkpoint is not None:
+                    for index, _ in batch:
+                        self.checkpoint.add(index)
+                    self.checkpoint.maybe_flush(self.sink, force=stopping)
+            except Exception as e:
+                self._error = e
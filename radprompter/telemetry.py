@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from array import array
+from collections import deque
+
+# Usage of the model call currently being tracked, filled in by `Client.record_usage`
+current_call = contextvars.ContextVar("radprompter_current_call", default=None)
+
+QUANTILES = [0.5, 0.95, 0.99]
+# Latencies kept per schema and turn to estimate the percentiles
+RESERVOIR_SIZE = 10000
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted sequence."""
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Reservoir:
+    """
+    Uniform random sample of at most `size` values of a stream (Vitter's algorithm R), with the
+    exact count and sum of all values, so that percentiles are estimated in constant memory.
+    """
+
+    def __init__(self, size=RESERVOIR_SIZE, rng=None):
+        self.size = size
+        self.values = array("d")
+        self.count = 0
+        self.sum = 0.0
+        self._rng = rng or random.Random()
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            position = self._rng.randrange(self.count)
+            if position < self.size:
+                self.values[position] = value
+
+    def percentiles(self, prefix="p"):
+        values = sorted(self.values)
+        return {f"{prefix}{int(q * 100)}": percentile(values, q) for q in QUANTILES}
+
+
+class Telemetry:
+    """
+    Per-request latency, token usage and cost of a run, broken down by schema and turn.
+
+    Every model call made by the engine is wrapped in `track`, which measures its latency with a
+    monotonic clock and collects the usage reported by the client. Aggregates are kept for the
+    whole run in constant memory: counts and sums are exact, percentiles are estimated from a
+    reservoir sample of `reservoir_size` latencies per schema and turn. The individual calls can
+    be streamed to `spans_path` as OpenTelemetry-style spans, and the most recent `max_spans`
+    of them kept in memory.
+
+    Examples:
+        engine(reports)
+        print(engine.telemetry.summary())
+        engine.telemetry.write_prometheus("metrics.prom")
+
+        engine = RadPrompter(client=client, prompt=prompt, output_file="output.csv", spans_file="spans.jsonl")
+    """
+
+    def __init__(self, model=None, max_spans=0, spans_path=None, reservoir_size=RESERVOIR_SIZE):
+        """
+        Args:
+            model (str): Model name, added to the spans
+            max_spans (int): Number of most recent calls kept in memory as spans (default: 0, none)
+            spans_path (str): JSON Lines file every span is appended to while the run goes on (default: None)
+            reservoir_size (int): Number of latencies sampled per schema and turn for the percentiles
+        """
+        self.model = model
+        self.max_spans = max_spans
+        self.spans_path = spans_path
+        self.reservoir_size = reservoir_size
+        self._spans_file = None
+        self.reset()
+
+    def reset(self):
+        self.close()
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._rng = random.Random(0)
+        self._latencies = Reservoir(self.reservoir_size, self._rng)
+        self._first_token_latencies = Reservoir(self.reservoir_size, self._rng)
+        self.spans = deque(maxlen=self.max_spans)
+        self._trace_id = os.urandom(16).hex()
+        if self.spans_path is not None:
+            self._spans_file = open(self.spans_path, "w")
+
+    def close(self):
+        """Close the spans file, if any."""
+        if getattr(self, "_spans_file", None) is not None:
+            self._spans_file.close()
+            self._spans_file = None
+
+    def track(self, schema, turn, index):
+        """Context manager measuring one model call of `schema` at `turn` for item `index`."""
+        return _TrackedCall(self, schema, turn, index)
+
+    def record(self, schema, turn, index, start, end, latency, usage, error=None):
+        with self._lock:
+            group = self._groups.get((schema, turn))
+            if group is None:
+                group = self._groups[(schema, turn)] = {
+                    "requests": 0, "errors": 0, "cache_hits": 0, "early_stops": 0,
+                    "latencies": Reservoir(self.reservoir_size, self._rng),
+                    "first_token_latencies": Reservoir(self.reservoir_size, self._rng),
+                    "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0,
+                }
+            group["requests"] += 1
+            group["errors"] += error is not None
+            group["cache_hits"] += bool(usage.get("cache_hit"))
+            group["early_stops"] += bool(usage.get("early_stop"))
+            group["latencies"].add(latency)
+            self._latencies.add(latency)
+            if usage.get("time_to_first_token") is not None:
+                group["first_token_latencies"].add(usage["time_to_first_token"])
+                self._first_token_latencies.add(usage["time_to_first_token"])
+            for key in ["prompt_tokens", "completion_tokens", "cached_tokens", "cost"]:
+                group[key] += usage.get(key, 0)
+
+            if self._spans_file is None and not self.max_spans:
+                return
+            attributes = {
+                "gen_ai.request.model": self.model,
+                "gen_ai.usage.input_tokens": usage.get("prompt_tokens", 0),
+                "gen_ai.usage.output_tokens": usage.get("completion_tokens", 0),
+                "radprompter.usage.cached_tokens": usage.get("cached_tokens", 0),
+                "radprompter.cost_usd": usage.get("cost", 0.0),
+                "radprompter.cache_hit": bool(usage.get("cache_hit")),
+                "radprompter.schema": schema,
+                "radprompter.turn": turn,
+                "radprompter.item_index": index,
+            }
+            if "time_to_complete" in usage:
+                attributes["radprompter.time_to_first_token_s"] = usage["time_to_first_token"]
+                attributes["radprompter.time_to_complete_s"] = usage["time_to_complete"]
+                attributes["radprompter.early_stop"] = bool(usage.get("early_stop"))
+            span = {
+                "name": "radprompter.ask_model",
+                "trace_id": self._trace_id,
+                "span_id": os.urandom(8).hex(),
+                "start_time_unix_nano": start,
+                "end_time_unix_nano": end,
+                "attributes": attributes,
+                "status": {"code": "ERROR", "message": str(error)} if error is not None else {"code": "OK"},
+            }
+            if self.max_spans:
+                self.spans.append(span)
+            if self._spans_file is not None:
+                self._spans_file.write(json.dumps(span, default=str) + "\n")
+
+    def summary(self):
+        """
+        Aggregate the calls per schema and turn.
+
+        Returns:
+            dict: {(schema, turn): {"requests", "errors", "cache_hits", "early_stops", "p50", "p95", "p99",
+                   "mean", "ttft_p50", "ttft_p95", "ttft_p99", "prompt_tokens", "completion_tokens",
+                   "cached_tokens", "cost"}}, latencies in seconds (time to first token of streamed calls only)
+        """
+        summary = {}
+        with self._lock:
+            for key, group in self._groups.items():
+                group = dict(group)
+                latencies = group.pop("latencies")
+                first_token_latencies = group.pop("first_token_latencies")
+                summary[key] = {
+                    **group,
+                    **latencies.percentiles(),
+                    "mean": latencies.sum / latencies.count if latencies.count else None,
+                    **first_token_latencies.percentiles("ttft_p"),
+                }
+        return summary
+
+    def totals(self):
+        """Return the request, error, token and cost totals of the run, with latency percentiles over all calls."""
+        with self._lock:
+            totals = {
+                key: sum(group[key] for group in self._groups.values())
+                for key in ["requests", "errors", "cache_hits", "early_stops", "prompt_tokens", "completion_tokens", "cached_tokens", "cost"]
+            }
+            totals.update(self._latencies.percentiles())
+            totals.update(self._first_token_latencies.percentiles("ttft_p"))
+        return totals
+
+    def log_entries(self):
+        """Return the summary as `key: value` entries for the run log."""
+        totals = self.totals()
+        if not totals["requests"]:
+            return {}
+
+        entries = {
+            "Requests": totals["requests"],
+            "Failed Requests": totals["errors"],
+            "Request Latency": self._format_latencies(totals),
+            "Estimated Cost (USD)": round(totals["cost"], 6),
+        }
+        if totals["ttft_p50"] is not None:
+            entries["Time to First Token"] = self._format_latencies(totals, "ttft_p")
+            entries["Streams Ended Early"] = totals["early_stops"]
+        for (schema, turn), group in self.summary().items():
+            entries[f"Schema {schema} Turn {turn}"] = (
+                f"requests={group['requests']}, errors={group['errors']}, cache_hits={group['cache_hits']}, "
+                f"{self._format_latencies(group)}, prompt_tokens={group['prompt_tokens']}, "
+                f"completion_tokens={group['completion_tokens']}, cached_tokens={group['cached_tokens']}, "
+                f"cost_usd={round(group['cost'], 6)}"
+            )
+        return entries
+
+    def to_prometheus(self, prefix="radprompter"):
+        """Render the aggregates in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_request_latency_seconds Latency of model calls.",
+            f"# TYPE {prefix}_request_latency_seconds summary",
+        ]
+        for (schema, turn), group in summary.items():
+            labels = f'schema="{_escape(schema)}",turn="{turn}"'
+            for q in QUANTILES:
+                value = group[f"p{int(q * 100)}"]
+                lines.append(f'{prefix}_request_latency_seconds{{{labels},quantile="{q}"}} {value if value is not None else "NaN"}')
+            lines.append(f"{prefix}_request_latency_seconds_sum{{{labels}}} {(group['mean'] or 0) * group['requests']}")
+            lines.append(f"{prefix}_request_latency_seconds_count{{{labels}}} {group['requests']}")
+
+        streamed = {key: group for key, group in summary.items() if group["ttft_p50"] is not None}
+        if streamed:
+            lines.append(f"# HELP {prefix}_time_to_first_token_seconds Time to the first answer token of streamed model calls.")
+            lines.append(f"# TYPE {prefix}_time_to_first_token_seconds summary")
+            for (schema, turn), group in streamed.items():
+                labels = f'schema="{_escape(schema)}",turn="{turn}"'
+                for q in QUANTILES:
+                    lines.append(f'{prefix}_time_to_first_token_seconds{{{labels},quantile="{q}"}} {group[f"ttft_p{int(q * 100)}"]}')
+
+        counters = [
+            ("requests_total", "Model calls.", lambda group: [("", group["requests"])]),
+            ("request_errors_total", "Failed model calls.", lambda group: [("", group["errors"])]),
+            ("cache_hits_total", "Model calls answered from the response cache.", lambda group: [("", group["cache_hits"])]),
+            ("early_stops_total", "Streamed model calls closed once the answer was complete.", lambda group: [("", group["early_stops"])]),
+            ("tokens_total", "Tokens used by model calls.", lambda group: [
+                (',type="prompt"', group["prompt_tokens"]),
+                (',type="completion"', group["completion_tokens"]),
+                (',type="cached"', group["cached_tokens"]),
+            ]),
+            ("cost_usd_total", "Estimated cost of model calls in USD.", lambda group: [("", group["cost"])]),
+        ]
+        for name, description, values in counters:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (schema, turn), group in summary.items():
+                for extra_labels, value in values(group):
+                    lines.append(f'{prefix}_{name}{{schema="{_escape(schema)}",turn="{turn}"{extra_labels}}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w") as f:
+            f.write(self.to_prometheus())
+
+    def write_spans(self, path):
+        """Write the spans kept in memory (see `max_spans`) as JSON Lines."""
+        with open(path, "w") as f:
+            for span in list(self.spans):
+                f.write(json.dumps(span, default=str) + "\n")
+
+    @staticmethod
+    def _format_latencies(group, prefix="p"):
+        return ", ".join(
+            f"{prefix}{int(q * 100)}={group[f'{prefix}{int(q * 100)}']:.3f}s" if group[f"{prefix}{int(q * 100)}"] is not None else f"{prefix}{int(q * 100)}=NaN"
+            for q in QUANTILES
+        )
+
+
+class _TrackedCall:
+    def __init__(self, telemetry, schema, turn, index):
+        self.telemetry = telemetry
+        self.schema = schema
+        self.turn = turn
+        self.index = index
+
+    def __enter__(self):
+        self.usage = {}
+        self._token = current_call.set(self.usage)
+        self._start = time.time_ns()
+        self._perf_start = time.perf_counter()
+        return self.usage
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = time.perf_counter() - self._perf_start
+        current_call.reset(self._token)
+        self.telemetry.record(self.schema, self.turn, self.index, self._start, time.time_ns(), latency, self.usage, error=exc)
+        return False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")